@@ -1,15 +1,23 @@
 import random
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, stream_with_context
 from flask_cors import CORS
 from functools import wraps
-from datetime import datetime, timedelta
+from datetime import datetime
+from itertools import islice
 import json
+import math
+import threading
+import time
 
 from auth import AuthService
 from config import Config
-from models import Event, ConfigSetting, User, ReplayProgress, db, ScheduledEvent
-from user_generator import EventGenerator
+from models import Event, ConfigSetting, User, ReplayProgress, db, ScheduledEvent, EventWriter, upgrade_schema, \
+    configure_sqlite, poll_events, browse_events, encode_cursor, decode_cursor, counter_totals, new_lease, \
+    ack_events, event_notifier, stream_events, latest_event_id, export_events
+from retention import RetentionService
+from archive import EventArchive
+from event_generator import EventGenerator
 from setup import init_database, seed_users, seed_historical_events, show_status
 
 app = Flask(__name__)
@@ -17,7 +25,11 @@ app.config.from_object(Config)
 
 # Initialize extensions
 db.init_app(app)
-CORS(app)
+configure_sqlite(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Lease-Id', 'X-Lease-Expires'])
+
+# Open event streams in this process, see stream_platform_events
+stream_slots = threading.BoundedSemaphore(app.config['MAX_STREAMS'])
 
 
 # Authentication decorator
@@ -31,6 +43,113 @@ def login_required(f):
     return decorated_function
 
 
+def json_array_response(items):
+    """Response for a JSON array whose items are already encoded"""
+    return app.response_class('[' + ','.join(items) + ']', mimetype=app.json.mimetype)
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    """True if the client asked for newline-delimited JSON over a JSON array"""
+    return request.accept_mimetypes.best_match([app.json.mimetype, NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(items):
+    """Streamed response of already encoded JSON items, one per line
+
+    ``items`` is consumed lazily while the response is sent, in writes of
+    EXPORT_FETCH_ROWS lines, so a generator of items is never held in full.
+    """
+    chunk_rows = app.config['EXPORT_FETCH_ROWS']
+
+    def generate(items):
+        while True:
+            chunk = list(islice(items, chunk_rows))
+            if not chunk:
+                break
+            yield ''.join(item + '\n' for item in chunk)
+
+    return app.response_class(stream_with_context(generate(iter(items))), mimetype=NDJSON_MIMETYPE)
+
+
+def wait_for_events(platform, read, wait):
+    """Call read() until its events are non-empty or ``wait`` seconds pass
+
+    Between reads the request sleeps until an EventWriter in this process
+    commits events for the platform, rereading at least every
+    LONG_POLL_RECHECK_SECONDS to see writes from other processes. The
+    session is closed before each sleep, so waiters hold no connection.
+    read() returns (events, extra); the last result is returned.
+    """
+    deadline = time.monotonic() + wait
+    if wait > 0:
+        event_notifier.watch(app)
+    while True:
+        version = event_notifier.version(platform)
+        result = read()
+        remaining = deadline - time.monotonic()
+        if result[0] or remaining <= 0:
+            return result
+        db.session.close()
+        event_notifier.wait(platform, version, min(remaining, app.config['LONG_POLL_RECHECK_SECONDS']))
+
+
+def poll_response(platform, limit, consume):
+    """Serve a poll, leasing the events when ?lease=SECONDS (or EVENT_LEASE_SECONDS) is set
+
+    Non-consuming reads page with ?cursor=, taken from the X-Next-Cursor
+    header of the previous page; the header is absent on the last page.
+    With ?wait=SECONDS an empty poll is held open until events arrive.
+    With Accept: application/x-ndjson the events are sent one per line;
+    non-consuming reads are then streamed from the database, up to
+    MAX_EXPORT_BATCH_SIZE events and without a next page cursor.
+    """
+    wait = request.args.get('wait', 0, type=float)
+    if not math.isfinite(wait):
+        return jsonify({'success': False, 'message': 'Invalid wait'}), 400
+    wait = min(max(wait, 0), app.config['MAX_POLL_WAIT_SECONDS'])
+    limit = max(limit, 0)
+    ndjson = wants_ndjson()
+
+    if not consume:
+        after = None
+        if request.args.get('cursor'):
+            after = decode_cursor(request.args['cursor'])
+            if after is None:
+                return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+
+        if ndjson:
+            limit = min(limit, app.config['MAX_EXPORT_BATCH_SIZE'])
+            if wait > 0:
+                wait_for_events(platform, lambda: browse_events(platform, 1, after), wait)
+            db.session.close()
+            return ndjson_response(export_events(platform, limit, after))
+
+        limit = min(limit, app.config['MAX_EVENT_BATCH_SIZE'])
+        events, next_key = wait_for_events(platform, lambda: browse_events(platform, limit, after), wait)
+        response = json_array_response(events)
+        if next_key:
+            response.headers['X-Next-Cursor'] = encode_cursor(next_key)
+        return response
+
+    lease_seconds = request.args.get('lease', app.config['EVENT_LEASE_SECONDS'], type=int)
+    lease_seconds = min(lease_seconds, app.config['MAX_EVENT_LEASE_SECONDS'])
+    limit = min(limit, app.config['MAX_EVENT_BATCH_SIZE'])
+
+    def claim():
+        lease = new_lease(lease_seconds) if lease_seconds > 0 else None
+        return poll_events(platform, limit, lease), lease
+
+    events, lease = wait_for_events(platform, claim, wait)
+    response = ndjson_response(events) if ndjson else json_array_response(events)
+    if lease:
+        response.headers['X-Lease-Id'] = lease[0]
+        response.headers['X-Lease-Expires'] = lease[1].isoformat() + 'Z'
+    return response
+
+
 # ============================================================================
 # UI ROUTES
 # ============================================================================
@@ -124,60 +243,109 @@ def api_docs():
 def get_slack_events():
     """Fetch unconsumed Slack events"""
     limit = request.args.get('limit', app.config['EVENT_BATCH_SIZE'], type=int)
-    limit = min(limit, app.config['MAX_EVENT_BATCH_SIZE'])
     consume = request.args.get('consumed', default='true').lower() == 'true'
 
-    events = Event.query.filter_by(
-        platform='slack',
-        consumed=False
-    ).order_by(Event.timestamp.asc()).limit(limit).all()
-
-    if consume:
-        for event in events:
-            event.consumed = True
-        db.session.commit()
-
-    return jsonify([event.to_dict() for event in events])
+    return poll_response('slack', limit, consume)
 
 
 @app.route('/api/teams/events', methods=['GET'])
 def get_teams_events():
     """Fetch unconsumed Teams events"""
     limit = request.args.get('limit', app.config['EVENT_BATCH_SIZE'], type=int)
-    limit = min(limit, app.config['MAX_EVENT_BATCH_SIZE'])
     # Optional consumed flag — default = True
     consume = request.args.get('consumed', default='true').lower() == 'true'
 
-    events = Event.query.filter_by(
-        platform='teams',
-        consumed=False
-    ).order_by(Event.timestamp.asc()).limit(limit).all()
-
-    if consume:
-        for event in events:
-            event.consumed = True
-        db.session.commit()
-
-    return jsonify([event.to_dict() for event in events])
+    return poll_response('teams', limit, consume)
 
 
 @app.route('/api/jira/events', methods=['GET'])
 def get_jira_events():
     """Fetch unconsumed Jira events"""
     limit = request.args.get('limit', app.config['EVENT_BATCH_SIZE'], type=int)
-    limit = min(limit, app.config['MAX_EVENT_BATCH_SIZE'])
     consume = request.args.get('consumed', default='true').lower() == 'true'
-    events = Event.query.filter_by(
-        platform='jira',
-        consumed=False
-    ).order_by(Event.timestamp.asc()).limit(limit).all()
-
-    if consume:
-        for event in events:
-            event.consumed = True
-        db.session.commit()
+    return poll_response('jira', limit, consume)
+
+
+@app.route('/api/events/ack', methods=['POST'])
+def ack_leased_events():
+    """Acknowledge leased events as processed"""
+    data = request.get_json() or {}
+    lease_id = data.get('lease_id')
+    if not lease_id:
+        return jsonify({'success': False, 'message': 'Missing lease_id'}), 400
+
+    event_ids = None
+    if data.get('event_ids') is not None:
+        if not isinstance(data['event_ids'], list):
+            return jsonify({'success': False, 'message': 'event_ids must be a list'}), 400
+        event_ids = [Event.parse_public_id(event_id) for event_id in data['event_ids']]
+        if None in event_ids:
+            return jsonify({'success': False, 'message': 'Invalid event id'}), 400
+
+    acked = ack_events(lease_id, event_ids)
+    return jsonify({'success': True, 'acked': acked})
+
+
+@app.route('/api/<platform>/stream', methods=['GET'])
+def stream_platform_events(platform):
+    """Server-Sent Events stream of a platform's events as they are committed
+
+    Each message's id is the event_id; reconnecting with Last-Event-ID (or
+    ?after=event_id) resumes after it, otherwise the stream starts with the
+    next new event. Events are read from the database in batches, only when
+    the writers signal a commit, and each batch is read only after the
+    previous one was written out: a slow client holds back its own reads
+    instead of buffering, and catches up from where it is when it drains.
+    Events are not consumed. A stream holds a worker thread for as long as
+    it is open, so beyond MAX_STREAMS per process new ones get a 503.
+    """
+    if platform not in EventGenerator.SAMPLERS:
+        return jsonify({'error': 'Not found'}), 404
+
+    resume = request.headers.get('Last-Event-ID') or request.args.get('after')
+    if resume:
+        position = Event.parse_public_id(resume)
+        if position is None:
+            return jsonify({'success': False, 'message': 'Invalid event id'}), 400
+    else:
+        position = latest_event_id()
+    db.session.close()
+
+    if not stream_slots.acquire(blocking=False):
+        response = jsonify({'success': False, 'message': 'Too many open streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(app.config['STREAM_KEEPALIVE_SECONDS'])
+        return response
+
+    batch_size = app.config['STREAM_BATCH_SIZE']
+    keepalive = app.config['STREAM_KEEPALIVE_SECONDS']
+    event_notifier.watch(app)
+
+    def generate(position):
+        yield 'retry: 3000\n\n'
+        while True:
+            version = event_notifier.version(platform)
+            events = stream_events(platform, position, batch_size)
+            # Don't hold a pooled connection while waiting or writing
+            db.session.close()
+
+            if events:
+                position = events[-1][0]
+                yield ''.join(
+                    f'id: {Event.format_public_id(event_id)}\ndata: {event}\n\n' for event_id, event in events
+                )
+                if len(events) == batch_size:
+                    continue
+
+            if not event_notifier.wait(platform, version, keepalive):
+                yield ': keepalive\n\n'
 
-    return jsonify([event.to_dict() for event in events])
+    response = app.response_class(stream_with_context(generate(position)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Runs when the server closes the response, whether or not it was read
+    response.call_on_close(stream_slots.release)
+    return response
 
 
 # ============================================================================
@@ -230,29 +398,23 @@ def config_api():
 def get_stats():
     """Get system statistics"""
 
+    # Totals come from the event_counters table rather than counting events
+    totals = counter_totals('platform')
+    today = counter_totals('platform', day=datetime.utcnow().date())
+
     # Total events by platform
-    slack_total = Event.query.filter_by(platform='slack').count()
-    teams_total = Event.query.filter_by(platform='teams').count()
-    jira_total = Event.query.filter_by(platform='jira').count()
+    slack_total = totals.get('slack', (0, 0))[0]
+    teams_total = totals.get('teams', (0, 0))[0]
+    jira_total = totals.get('jira', (0, 0))[0]
 
     # Today's events
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    slack_today = Event.query.filter(
-        Event.platform == 'slack',
-        Event.timestamp >= today_start
-    ).count()
-    teams_today = Event.query.filter(
-        Event.platform == 'teams',
-        Event.timestamp >= today_start
-    ).count()
-    jira_today = Event.query.filter(
-        Event.platform == 'jira',
-        Event.timestamp >= today_start
-    ).count()
+    slack_today = today.get('slack', (0, 0))[0]
+    teams_today = today.get('teams', (0, 0))[0]
+    jira_today = today.get('jira', (0, 0))[0]
 
     # Total and consumed events
-    total_events = Event.query.count()
-    consumed_events = Event.query.filter_by(consumed=True).count()
+    total_events = sum(total for total, consumed in totals.values())
+    consumed_events = sum(consumed for total, consumed in totals.values())
 
     # User count
     user_count = User.query.count()
@@ -353,7 +515,8 @@ def update_replay_progress():
 def start_replay():
     """Manually start historical replay"""
     # Count historical events
-    historical_events = Event.query.filter_by(source='historical', consumed=False).count()
+    total, consumed = counter_totals('source').get('historical', (0, 0))
+    historical_events = total - consumed
 
     if historical_events == 0:
         return jsonify({'success': False, 'message': 'No historical events to replay'}), 400
@@ -429,13 +592,12 @@ def simulate_events():
     generated = []
     for user in users[:count]:
         timestamp = datetime.utcnow()
-        event_data = EventGenerator.generate_event(user, platform, timestamp, source='manual')
+        generated.append(EventGenerator.generate_event(
+            user, platform, timestamp, source='manual', lazy=app.config['LAZY_PAYLOADS']
+        ))
 
-        event = Event(**event_data)
-        db.session.add(event)
-        generated.append(event_data)
-
-    db.session.commit()
+    with EventWriter() as writer:
+        writer.write(generated)
 
     return jsonify({
         'success': True,
@@ -498,14 +660,8 @@ def get_users():
 @login_required
 def cleanup_database():
     """Clean up old events based on retention policy"""
-    retention_days = app.config['RETENTION_DAYS']
-    cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
-
-    # Delete old consumed events
-    deleted = Event.query.filter(
-        Event.consumed == True,
-        Event.timestamp < cutoff_date
-    ).delete()
+    # Old events are removed by a background retention pass
+    started = RetentionService.run_in_background(app)
 
     # Cleanup expired auth tokens
     AuthService.cleanup_expired_tokens()
@@ -514,8 +670,35 @@ def cleanup_database():
 
     return jsonify({
         'success': True,
-        'message': f'Deleted {deleted} old events'
-    })
+        'message': 'Retention pass started' if started else 'Retention pass already running'
+    }), 202
+
+
+@app.route('/api/retention/status', methods=['GET'])
+@login_required
+def retention_status():
+    """Get progress of the current or last retention pass"""
+    return jsonify(RetentionService.get_progress().to_dict())
+
+
+@app.route('/api/archive/events', methods=['GET'])
+@login_required
+def get_archived_events():
+    """Read archived events by time range, streamed as NDJSON if asked for"""
+    ndjson = wants_ndjson()
+    limit = request.args.get('limit', app.config['EVENT_BATCH_SIZE'], type=int)
+    limit = max(min(limit, app.config['MAX_EXPORT_BATCH_SIZE' if ndjson else 'MAX_EVENT_BATCH_SIZE']), 0)
+    platform = request.args.get('platform')
+    try:
+        start = datetime.fromisoformat(request.args['start'].rstrip('Z')) if 'start' in request.args else None
+        end = datetime.fromisoformat(request.args['end'].rstrip('Z')) if 'end' in request.args else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid datetime format'}), 400
+
+    records = islice(EventArchive().scan(start, end, platform), limit)
+    if ndjson:
+        return ndjson_response(app.json.dumps(EventArchive.to_dict(record)) for record in records)
+    return jsonify([EventArchive.to_dict(record) for record in records])
 
 
 @app.route('/api/setup', methods=['GET'])
@@ -543,7 +726,7 @@ def health_check():
     """Health check endpoint"""
     try:
         # Check database connection
-        db.session.execute('SELECT 1')
+        db.session.execute(db.text('SELECT 1'))
 
         return jsonify({
             'status': 'healthy',
@@ -578,6 +761,7 @@ def internal_error(e):
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        upgrade_schema()
 
     app.run(
         host='0.0.0.0',
@@ -0,0 +1,221 @@
+from flask import current_app
+from datetime import datetime
+import json
+import os
+import re
+
+import numpy as np
+
+from models import Event, EventWriter, User, bump_counters, db, event_tables, tally_events
+
+
+class EventArchive:
+    """Columnar chunk files of consumed events on local disk.
+
+    Each chunk is an .npz file of column arrays: platform, event_type,
+    event_category, user_id and source are dictionary-encoded, ids and
+    timestamps are delta-encoded int64, and payloads are one UTF-8 blob
+    with per-row lengths. Lazy payloads are rendered on the way in, so a
+    chunk reads back without the users table. File names carry the time
+    range of the chunk, so range scans only open the files they need.
+    """
+
+    CHUNK_NAME = re.compile(r'^(\d+)-(\d+)-([0-9a-f]+)\.npz$')
+    DICTIONARY_COLUMNS = ('platform', 'event_type', 'event_category', 'user_id', 'source')
+
+    # Most SQLite builds cap a statement at 32766 bound parameters
+    DELETE_BATCH = 5000
+
+    def __init__(self, directory=None):
+        self.directory = directory or current_app.config['ARCHIVE_DIR']
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def archive_consumed(self, before):
+        """Move consumed events older than ``before`` into chunk files
+
+        Returns the number of events archived. A chunk's rows are deleted
+        from the database only after its file is in place.
+        """
+        chunk_rows = current_app.config['ARCHIVE_CHUNK_ROWS']
+        users = User.__table__
+        os.makedirs(self.directory, exist_ok=True)
+
+        archived = 0
+        for table in event_tables(end=before):
+            while True:
+                rows = db.session.execute(
+                    db.select(table, users.c.name.label('user_name'))
+                    .outerjoin(users, users.c.id == table.c.user_id)
+                    .where(table.c.consumed == True, table.c.timestamp < before)
+                    .order_by(table.c.timestamp, table.c.id)
+                    .limit(chunk_rows)
+                ).all()
+                if not rows:
+                    break
+
+                self.write_chunk(rows)
+                ids = [row.id for row in rows]
+                for start in range(0, len(ids), self.DELETE_BATCH):
+                    db.session.execute(table.delete().where(table.c.id.in_(ids[start:start + self.DELETE_BATCH])))
+                bump_counters(tally_events(
+                    (row.timestamp, row.platform, row.source, row.consumed) for row in rows
+                ), sign=-1)
+                db.session.commit()
+                archived += len(rows)
+
+        return archived
+
+    def write_chunk(self, rows):
+        """Encode event rows sorted by (timestamp, id) into one chunk file"""
+        columns = {}
+        for name in self.DICTIONARY_COLUMNS:
+            columns[name + '_values'], columns[name] = EventArchive.dictionary_encode(
+                [getattr(row, name) for row in rows]
+            )
+
+        timestamps = np.array([row.timestamp for row in rows], dtype='datetime64[us]').astype(np.int64)
+        columns['timestamp'] = EventArchive.delta_encode(timestamps)
+        columns['id'] = EventArchive.delta_encode(np.array([row.id for row in rows], dtype=np.int64))
+        columns['created_at'] = EventArchive.delta_encode(
+            np.array([row.created_at or row.timestamp for row in rows], dtype='datetime64[us]').astype(np.int64)
+        )
+
+        payloads = [Event.payload_text(row, row.user_name).encode() for row in rows]
+        columns['payload_lengths'] = np.array([len(payload) for payload in payloads], dtype=np.int32)
+        columns['payload'] = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+
+        name = f"{timestamps[0]}-{timestamps[-1]}-{rows[0].id:x}.npz"
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.replace(path + '.tmp', path)
+        return path
+
+    @staticmethod
+    def dictionary_encode(values):
+        """Return (distinct values, codes into them)"""
+        dictionary, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+        code_type = np.uint16 if len(dictionary) <= np.iinfo(np.uint16).max else np.uint32
+        return dictionary, codes.astype(code_type)
+
+    @staticmethod
+    def delta_encode(values):
+        return np.diff(values, prepend=0)
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def chunks(self, start=None, end=None):
+        """Chunk files overlapping [start, end), ordered by first timestamp"""
+        if not os.path.isdir(self.directory):
+            return []
+
+        low = EventArchive.to_micros(start) if start else None
+        high = EventArchive.to_micros(end) if end else None
+        found = []
+        for name in os.listdir(self.directory):
+            match = self.CHUNK_NAME.match(name)
+            if not match:
+                continue
+            first, last = int(match[1]), int(match[2])
+            if (low is None or last >= low) and (high is None or first < high):
+                found.append((first, os.path.join(self.directory, name)))
+        return [path for first, path in sorted(found)]
+
+    def scan(self, start=None, end=None, platform=None):
+        """Yield archived events with start <= timestamp < end, chunk by chunk
+
+        Events come back as dicts with the events table's columns, in
+        timestamp order within each chunk.
+        """
+        low = EventArchive.to_micros(start) if start else None
+        high = EventArchive.to_micros(end) if end else None
+
+        for path in self.chunks(start, end):
+            with np.load(path) as data:
+                timestamps = np.cumsum(data['timestamp'])
+                mask = np.ones(len(timestamps), dtype=bool)
+                if low is not None:
+                    mask &= timestamps >= low
+                if high is not None:
+                    mask &= timestamps < high
+                if platform is not None:
+                    matches = np.flatnonzero(data['platform_values'] == platform)
+                    mask &= np.isin(data['platform'], matches)
+                selected = np.flatnonzero(mask)
+                if not len(selected):
+                    continue
+
+                columns = {
+                    name: data[name + '_values'][data[name]].tolist()
+                    for name in self.DICTIONARY_COLUMNS
+                }
+                ids = np.cumsum(data['id']).tolist()
+                created = np.cumsum(data['created_at'])
+                ends = np.cumsum(data['payload_lengths'])
+                blob = data['payload'].tobytes()
+
+            times = timestamps.astype('datetime64[us]').astype(datetime)
+            created = created.astype('datetime64[us]').astype(datetime)
+            for i in selected:
+                yield {
+                    'id': ids[i],
+                    'user_id': columns['user_id'][i],
+                    'platform': columns['platform'][i],
+                    'event_type': columns['event_type'][i],
+                    'event_category': columns['event_category'][i],
+                    'timestamp': times[i],
+                    'payload': blob[ends[i - 1] if i else 0:ends[i]].decode(),
+                    'source': columns['source'][i],
+                    'created_at': created[i],
+                }
+
+    def restore(self, start=None, end=None, platform=None):
+        """Copy archived events back into the database as unconsumed, for re-replay
+
+        Restored events get new ids. Returns the number of events restored.
+        """
+        batch_size = current_app.config['EVENT_INSERT_BATCH_SIZE']
+        batch = []
+        with EventWriter() as writer:
+            for record in self.scan(start, end, platform):
+                batch.append({
+                    'user_id': record['user_id'],
+                    'platform': record['platform'],
+                    'event_type': record['event_type'],
+                    'event_category': record['event_category'],
+                    'timestamp': record['timestamp'],
+                    'payload': record['payload'],
+                    'payload_params': None,
+                    'consumed': False,
+                    'source': record['source'],
+                })
+                if len(batch) >= batch_size:
+                    writer.write(batch)
+                    batch = []
+            writer.write(batch)
+        return writer.written
+
+    @staticmethod
+    def to_dict(record):
+        """API representation of an archived event, like Event.to_dict()"""
+        return {
+            'event_id': Event.format_public_id(record['id']),
+            'user_id': record['user_id'],
+            'platform': record['platform'],
+            'event_type': record['event_type'],
+            'event_category': record['event_category'],
+            'timestamp': record['timestamp'].isoformat() + 'Z',
+            'payload': json.loads(record['payload']),
+            'consumed': True,
+            'source': record['source']
+        }
+
+    @staticmethod
+    def to_micros(timestamp):
+        return int(np.datetime64(timestamp, 'us').astype(np.int64))
+
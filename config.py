@@ -3,12 +3,65 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Which kind of process loaded the config: web, scheduler or setup
+PROCESS_ROLE = os.getenv('SIMULATOR_PROCESS', 'web')
+
+# Database connections each kind of process keeps in its pool
+DB_POOL_SIZES = {'web': 5, 'scheduler': 2, 'setup': 2}
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 30000))
+
+
+def database_uri():
+    """DATABASE_URL, with the postgres:// scheme some hosts hand out fixed up"""
+    uri = os.getenv('DATABASE_URL', 'sqlite:///simulator.db')
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(database_uri, role):
+    """SQLAlchemy engine options for the database and process role"""
+    pool_size = int(os.getenv('DB_POOL_SIZE', DB_POOL_SIZES.get(role, 5)))
+
+    if database_uri.startswith('sqlite'):
+        if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+            return {}
+        return {
+            'pool_size': pool_size,
+            'max_overflow': pool_size,
+            'pool_timeout': 30,
+            # Wait for the write lock instead of failing with "database is locked"
+            'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000, 'check_same_thread': False},
+        }
+
+    return {
+        'pool_size': pool_size,
+        'max_overflow': pool_size,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
+
 
 class Config:
     # Flask
     SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
-    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///simulator.db')
+    SQLALCHEMY_DATABASE_URI = database_uri()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, PROCESS_ROLE)
+
+    # Applied to every new SQLite connection: WAL lets pollers read while
+    # the scheduler or seeding writes
+    SQLITE_PRAGMAS = {
+        'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+        # Lets retention hand freed pages back with PRAGMA incremental_vacuum
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', 65536)),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+        'temp_store': 'MEMORY',
+    }
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SECURE = False  # Set True in production with HTTPS
     PERMANENT_SESSION_LIFETIME = 1800  # 30 minutes
@@ -31,4 +84,57 @@ class Config:
     WORKING_HOURS_END = 18
     EVENT_BATCH_SIZE = 50
     MAX_EVENT_BATCH_SIZE = 1000
+
+    # NDJSON reads (Accept: application/x-ndjson) stream rows from the
+    # database, so they may ask for many more than a JSON array can hold
+    MAX_EXPORT_BATCH_SIZE = int(os.getenv('MAX_EXPORT_BATCH_SIZE', 100000))
+    EXPORT_FETCH_ROWS = 1000
+
+    # Long polling: the longest ?wait= honoured, and how often a waiting poll
+    # rereads anyway (events written by other processes, expired leases)
+    MAX_POLL_WAIT_SECONDS = 60
+    LONG_POLL_RECHECK_SECONDS = float(os.getenv('LONG_POLL_RECHECK_SECONDS', 5))
+
+    # How often waiting polls and streams look for events committed by other
+    # processes (the scheduler), and the stream's read size and keepalive
+    EVENT_WATCH_INTERVAL_SECONDS = float(os.getenv('EVENT_WATCH_INTERVAL_SECONDS', 0.5))
+    STREAM_BATCH_SIZE = 500
+    STREAM_KEEPALIVE_SECONDS = 15
+    # Each open stream holds a worker thread (gunicorn --threads 16), so
+    # streams beyond this per process are refused to keep polls served
+    MAX_STREAMS = int(os.getenv('MAX_STREAMS', 8))
     RETENTION_DAYS = 180
+
+    # Background retention: pass interval, rows and time budget per delete
+    # chunk, pages freed per incremental_vacuum step
+    RETENTION_INTERVAL_MINUTES = int(os.getenv('RETENTION_INTERVAL_MINUTES', 60))
+    RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', 2000))
+    RETENTION_CHUNK_BUDGET_MS = int(os.getenv('RETENTION_CHUNK_BUDGET_MS', 50))
+    RETENTION_VACUUM_PAGES = int(os.getenv('RETENTION_VACUUM_PAGES', 1000))
+
+    # How often the event counters behind /api/stats are recounted
+    COUNTER_RECONCILE_MINUTES = int(os.getenv('COUNTER_RECONCILE_MINUTES', 60))
+
+    # Bulk event writer: rows per executemany and rows per transaction
+    EVENT_INSERT_BATCH_SIZE = int(os.getenv('EVENT_INSERT_BATCH_SIZE', 5000))
+    EVENT_INSERT_COMMIT_ROWS = int(os.getenv('EVENT_INSERT_COMMIT_ROWS', 50000))
+
+    # Columnar archive of consumed events; ARCHIVE_AFTER_DAYS=0 disables
+    # the scheduled archive job
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 0))
+    ARCHIVE_CHUNK_ROWS = int(os.getenv('ARCHIVE_CHUNK_ROWS', 20000))
+
+    # Polls with ?lease=SECONDS lease events until acked at /api/events/ack
+    # instead of consuming them; this sets the lease for polls without it
+    EVENT_LEASE_SECONDS = int(os.getenv('EVENT_LEASE_SECONDS', 0))
+    MAX_EVENT_LEASE_SECONDS = 3600
+
+    # Event storage layout: 'monthly' partitions or 'none' (single events table)
+    EVENT_PARTITIONING = os.getenv('EVENT_PARTITIONING', 'monthly')
+    # How long a process trusts its list of partitions before rereading it
+    PARTITION_CACHE_SECONDS = float(os.getenv('PARTITION_CACHE_SECONDS', 5))
+
+    # Store only payload generation parameters and render payloads on fetch
+    LAZY_PAYLOADS = os.getenv('LAZY_PAYLOADS', 'false').lower() == 'true'
+
@@ -1,10 +1,228 @@
+from bisect import bisect_right
+from collections import deque, namedtuple
 from datetime import datetime, timedelta
+from functools import lru_cache
+import heapq
+from itertools import accumulate, islice
+from operator import itemgetter
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
 import random
 import json
 
+import numpy as np
+
 from user_profiles import BEHAVIOR_PATTERNS
 
 
+# Cumulative hourly activity per behavior pattern, for EventGenerator.seconds_of_day
+PATTERN_INDEX = {pattern: i for i, pattern in enumerate(BEHAVIOR_PATTERNS)}
+ACTIVITY_CDFS = [
+    np.cumsum(config['hourly_activity'], dtype=float) / sum(config['hourly_activity'])
+    for config in BEHAVIOR_PATTERNS.values()
+]
+
+# Detached copy of the User columns the generators read, safe to hand to
+# other threads and processes
+UserRef = namedtuple('UserRef', ['id', 'name', 'behavior_pattern'])
+
+
+class PayloadTemplate:
+    """Pre-encoded JSON payload for one (platform, event_type) layout.
+
+    Keys, separators, constants and pool values are JSON-encoded once, so
+    rendering a payload is a single %-format of the variable parts. The
+    output is byte-for-byte what json.dumps gives for the equivalent dict.
+
+    Field kinds:
+      const      fixed value
+      choice     one value from a pool
+      ref        printf-style string over an integer range, e.g. 'C%d'
+      int        integer in an inclusive range
+      chance     boolean that is true with the given probability
+      ts         the event time as a Unix timestamp string
+      ts_before  Unix timestamp string a random number of minutes earlier
+      issue_key  '<project>-<number>' from a project pool and integer range
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.draws = sum(EventGenerator.FIELD_DRAWS[kind] for _, kind, _ in fields)
+        self._pools = []
+
+        parts = ['{"user_name": %s, "user_id": %s']
+        for key, kind, spec in fields:
+            if kind == 'const':
+                slot = json.dumps(spec).replace('%', '%%')
+            elif kind == 'choice':
+                slot = '%s'
+                self._pools.append(np.array([json.dumps(v) for v in spec], dtype=object))
+            elif kind == 'ref':
+                slot = json.dumps(spec[0])
+            elif kind == 'int':
+                slot = '%d'
+            elif kind == 'chance':
+                slot = '%s'
+            elif kind in ('ts', 'ts_before'):
+                slot = '"%s"'
+            elif kind == 'issue_key':
+                slot = '"%s-%d"'
+                self._pools.append(np.array([json.dumps(v)[1:-1] for v in spec[0]], dtype=object))
+            else:
+                raise ValueError(f"Unknown payload field kind: {kind}")
+            parts.append(', ' + json.dumps(key).replace('%', '%%') + ': ' + slot)
+        parts.append('}')
+        self.format = ''.join(parts)
+
+    @staticmethod
+    def _user_slot(user, cache):
+        slot = cache.get(user.id)
+        if slot is None:
+            slot = cache[user.id] = (json.dumps(user.name), json.dumps(user.id))
+        return slot
+
+    def param_columns(self, draws):
+        """Turn a block of uniform draws into integer generation parameters.
+
+        Returns one int array per draw column: pool indices, range values and
+        0/1 flags. Together with the user and event time they fully determine
+        the payload.
+        """
+        params = []
+        col = 0
+        for key, kind, spec in self.fields:
+            if kind == 'choice':
+                params.append((draws[:, col] * len(spec)).astype(np.int64))
+            elif kind in ('ref', 'int', 'ts_before'):
+                low, high = spec[-2:]
+                params.append(low + (draws[:, col] * (high - low + 1)).astype(np.int64))
+            elif kind == 'chance':
+                params.append((draws[:, col] < spec).astype(np.int64))
+            elif kind == 'issue_key':
+                pool, low, high = spec
+                params.append((draws[:, col] * len(pool)).astype(np.int64))
+                params.append(low + (draws[:, col + 1] * (high - low + 1)).astype(np.int64))
+            col += EventGenerator.FIELD_DRAWS[kind]
+        return params
+
+    def columns(self, params, times):
+        """Turn parameter columns into the format arguments per field"""
+        columns = []
+        params = iter(params)
+        pools = iter(self._pools)
+        for key, kind, spec in self.fields:
+            if kind == 'choice':
+                columns.append(next(pools)[next(params)].tolist())
+            elif kind in ('ref', 'int'):
+                columns.append(next(params).tolist())
+            elif kind == 'ts_before':
+                columns.append([f'{(t - timedelta(minutes=m)).timestamp()}'
+                                for t, m in zip(times, next(params).tolist())])
+            elif kind == 'chance':
+                columns.append(np.where(next(params) == 1, 'true', 'false').tolist())
+            elif kind == 'ts':
+                columns.append([f'{t.timestamp()}' for t in times])
+            elif kind == 'issue_key':
+                columns.append(next(pools)[next(params)].tolist())
+                columns.append(next(params).tolist())
+        return columns
+
+    def render_many(self, users, times, draws, user_slots=None):
+        """Render one payload string per row of ``draws``"""
+        cache = {} if user_slots is None else user_slots
+        heads = [self._user_slot(user, cache) for user in users]
+        columns = self.columns(self.param_columns(draws), times)
+        fmt = self.format
+        if not columns:
+            return [fmt % head for head in heads]
+        return [fmt % (head + values) for head, values in zip(heads, zip(*columns))]
+
+    def params_many(self, draws):
+        """Encode the generation parameters of each row as a compact string"""
+        params = self.param_columns(draws)
+        if not params:
+            return [''] * draws.shape[0]
+        return [','.join(map(str, row)) for row in np.column_stack(params).tolist()]
+
+    def draw_params(self, rand=random.random):
+        """Draw the generation parameters for a single payload"""
+        params = []
+        for key, kind, spec in self.fields:
+            if kind == 'choice':
+                params.append(int(rand() * len(spec)))
+            elif kind in ('ref', 'int', 'ts_before'):
+                low, high = spec[-2:]
+                params.append(low + int(rand() * (high - low + 1)))
+            elif kind == 'chance':
+                params.append(1 if rand() < spec else 0)
+            elif kind == 'issue_key':
+                pool, low, high = spec
+                params.append(int(rand() * len(pool)))
+                params.append(low + int(rand() * (high - low + 1)))
+        return params
+
+    def render_params(self, user_name, user_id, timestamp, params):
+        """Render a payload from its generation parameters"""
+        args = [json.dumps(user_name), json.dumps(user_id)]
+        params = iter(params)
+        pools = iter(self._pools)
+        for key, kind, spec in self.fields:
+            if kind == 'choice':
+                args.append(next(pools)[next(params)])
+            elif kind in ('ref', 'int'):
+                args.append(next(params))
+            elif kind == 'ts_before':
+                args.append(f'{(timestamp - timedelta(minutes=next(params))).timestamp()}')
+            elif kind == 'chance':
+                args.append('true' if next(params) else 'false')
+            elif kind == 'ts':
+                args.append(f'{timestamp.timestamp()}')
+            elif kind == 'issue_key':
+                args.append(next(pools)[next(params)])
+                args.append(next(params))
+        return self.format % tuple(args)
+
+    def render(self, user, timestamp, rand=random.random):
+        """Render a single payload, drawing its variable parts from ``rand``"""
+        return self.render_params(user.name, user.id, timestamp, self.draw_params(rand))
+
+
+class PlatformSampler:
+    """Precompiled event type sampler for one platform.
+
+    Built once per platform: holds the cumulative weights and resolves a
+    draw straight to (event_type, category, PayloadTemplate).
+    """
+
+    def __init__(self, events_dict, payload_fields):
+        event_types = list(events_dict.keys())
+        self.entries = [
+            (e, events_dict[e]['category'], PayloadTemplate(payload_fields[e]))
+            for e in event_types
+        ]
+        self.cum_weights = list(accumulate(events_dict[e]['weight'] for e in event_types))
+        self.total = self.cum_weights[-1]
+        self._cum_array = np.array(self.cum_weights, dtype=float)
+        # Uniform draws needed per event to fill any payload of this platform
+        self.width = max(template.draws for _, _, template in self.entries)
+
+    def sample(self):
+        """Draw one (event_type, category, template) entry"""
+        return self.entries[bisect_right(self.cum_weights, random.random() * self.total)]
+
+    def sample_indices(self, uniforms):
+        """Map an array of uniforms in [0, 1) to entry indices"""
+        return np.searchsorted(self._cum_array, uniforms * self.total, side='right')
+
+    def sample_many(self, n, rng=None):
+        """Draw ``n`` entries in one batch"""
+        uniforms = rng.random(n) if rng is not None else np.random.random(n)
+        return [self.entries[i] for i in self.sample_indices(uniforms).tolist()]
+
+
 class EventGenerator:
 
     SLACK_EVENTS = {
@@ -45,172 +263,165 @@ class EventGenerator:
     PRIORITIES = ['Highest', 'High', 'Medium', 'Low', 'Lowest']
     STATUSES = ['To Do', 'In Progress', 'In Review', 'Done']
 
-    @staticmethod
-    def weighted_choice(events_dict):
-        """Select event type based on weights"""
-        events = list(events_dict.keys())
-        weights = [events_dict[e]['weight'] for e in events]
-        return random.choices(events, weights=weights)[0]
+    SLACK_MESSAGES = [
+        "Sprint planning meeting starts in 10 minutes",
+        "Updated the documentation for the new API",
+        "Can someone review my PR?",
+        "Great work on the last release!",
+        "Has anyone encountered this error before?",
+        "Meeting notes are in the shared drive",
+        "Thanks for the quick turnaround on this",
+        "I'll take a look at this after lunch"
+    ]
+    SLACK_REACTIONS = ['thumbsup', 'eyes', 'tada', 'rocket', 'heart']
+    SLACK_FILES = ['design_mockup.png', 'report.pdf', 'data_analysis.xlsx']
+    SLACK_FILE_TYPES = ['image', 'pdf', 'document']
+    SLACK_MENTION_TEXT = "Can you take a look at this when you get a chance?"
+
+    TEAMS_MESSAGES = [
+        "Let's sync up this afternoon",
+        "Sharing the latest metrics",
+        "Who's available for a quick call?",
+        "Updated the project timeline"
+    ]
+    MEETING_TITLES = [
+        'Daily Standup', 'Sprint Planning', 'Team Sync',
+        '1:1 Meeting', 'Design Review', 'Retrospective'
+    ]
+    MEETING_DURATIONS = [15, 30, 60]
+    TEAMS_FILES = ['presentation.pptx', 'requirements.docx', 'budget.xlsx']
+
+    JIRA_SUMMARIES = [
+        'Implement user authentication',
+        'Fix login page bug',
+        'Update API documentation',
+        'Optimize database queries'
+    ]
+    JIRA_COMMENTS = [
+        'Working on this now',
+        'Needs more clarification',
+        'Ready for review',
+        'Blocked by dependency'
+    ]
+
+    # Payload layout per platform and event type, in payload key order.
+    # Each field is (key, kind, spec); see PayloadTemplate for the kinds.
+    _SLACK_MESSAGE = [
+        ('channel_id', 'ref', ('C%d', 10000, 99999)),
+        ('channel_name', 'choice', CHANNELS),
+        ('message_text', 'choice', SLACK_MESSAGES),
+        ('has_mentions', 'chance', 0.2),
+    ]
+    _TEAMS_MESSAGE = [
+        ('channel_id', 'ref', ('T%d', 10000, 99999)),
+        ('message_text', 'choice', TEAMS_MESSAGES),
+    ]
+    _TEAMS_MEETING = [
+        ('meeting_id', 'ref', ('M%d', 10000, 99999)),
+        ('meeting_title', 'choice', MEETING_TITLES),
+        ('duration_minutes', 'choice', MEETING_DURATIONS),
+        ('participants', 'int', (2, 8)),
+    ]
+    _JIRA_ISSUE = [
+        ('issue_key', 'issue_key', (PROJECTS, 100, 999)),
+        ('project_id', 'choice', PROJECTS),
+    ]
+
+    PAYLOAD_FIELDS = {
+        'slack': {
+            'message.channel': _SLACK_MESSAGE + [('thread_ts', 'const', None)],
+            'message.direct': _SLACK_MESSAGE + [('thread_ts', 'const', None)],
+            'message.thread': _SLACK_MESSAGE + [('thread_ts', 'ts', None)],
+            'reaction.add': [
+                ('channel_id', 'ref', ('C%d', 10000, 99999)),
+                ('reaction', 'choice', SLACK_REACTIONS),
+                ('message_ts', 'ts_before', (1, 60)),
+            ],
+            'mention': [
+                ('channel_id', 'ref', ('C%d', 10000, 99999)),
+                ('mentioned_user_id', 'ref', ('user_%03d', 1, 60)),
+                ('message_text', 'const', SLACK_MENTION_TEXT),
+            ],
+            'file.upload': [
+                ('channel_id', 'ref', ('C%d', 10000, 99999)),
+                ('file_name', 'choice', SLACK_FILES),
+                ('file_type', 'choice', SLACK_FILE_TYPES),
+            ],
+            'channel.join': [],
+            'status.update': [],
+        },
+        'teams': {
+            'message.channel': _TEAMS_MESSAGE,
+            'message.chat': _TEAMS_MESSAGE,
+            'meeting.scheduled': _TEAMS_MEETING,
+            'meeting.joined': _TEAMS_MEETING,
+            'meeting.ended': _TEAMS_MEETING,
+            'file.shared': [
+                ('file_name', 'choice', TEAMS_FILES),
+                ('file_size_kb', 'int', (100, 5000)),
+            ],
+            'reaction.add': [],
+            'mention': [],
+        },
+        'jira': {
+            'issue.updated': _JIRA_ISSUE,
+            'issue.status_changed': _JIRA_ISSUE + [
+                ('from_status', 'choice', STATUSES[:-1]),
+                ('to_status', 'choice', STATUSES[1:]),
+            ],
+            'issue.commented': _JIRA_ISSUE + [('comment', 'choice', JIRA_COMMENTS)],
+            'issue.created': _JIRA_ISSUE + [
+                ('issue_type', 'choice', ISSUE_TYPES),
+                ('priority', 'choice', PRIORITIES),
+                ('summary', 'choice', JIRA_SUMMARIES),
+            ],
+            'issue.assigned': _JIRA_ISSUE + [('assigned_to', 'ref', ('user_%03d', 1, 60))],
+            'issue.priority_changed': _JIRA_ISSUE + [
+                ('from_priority', 'choice', PRIORITIES),
+                ('to_priority', 'choice', PRIORITIES),
+            ],
+            'attachment.added': _JIRA_ISSUE,
+        },
+    }
 
-    @staticmethod
-    def generate_slack_event(user, event_type, timestamp):
-        """Generate Slack event payload"""
-        base = {
-            'user_name': user.name,
-            'user_id': user.id
-        }
+    # Number of uniform draws each field kind consumes
+    FIELD_DRAWS = {
+        'const': 0, 'ts': 0, 'choice': 1, 'ref': 1, 'int': 1,
+        'chance': 1, 'ts_before': 1, 'issue_key': 2,
+    }
 
-        if 'message' in event_type:
-            messages = [
-                "Sprint planning meeting starts in 10 minutes",
-                "Updated the documentation for the new API",
-                "Can someone review my PR?",
-                "Great work on the last release!",
-                "Has anyone encountered this error before?",
-                "Meeting notes are in the shared drive",
-                "Thanks for the quick turnaround on this",
-                "I'll take a look at this after lunch"
-            ]
-            base.update({
-                'channel_id': f'C{random.randint(10000, 99999)}',
-                'channel_name': random.choice(EventGenerator.CHANNELS),
-                'message_text': random.choice(messages),
-                'has_mentions': random.random() < 0.2,
-                'thread_ts': f'{timestamp.timestamp()}' if 'thread' in event_type else None
-            })
-
-        elif event_type == 'reaction.add':
-            base.update({
-                'channel_id': f'C{random.randint(10000, 99999)}',
-                'reaction': random.choice(['thumbsup', 'eyes', 'tada', 'rocket', 'heart']),
-                'message_ts': f'{(timestamp - timedelta(minutes=random.randint(1, 60))).timestamp()}'
-            })
-
-        elif event_type == 'file.upload':
-            base.update({
-                'channel_id': f'C{random.randint(10000, 99999)}',
-                'file_name': random.choice(['design_mockup.png', 'report.pdf', 'data_analysis.xlsx']),
-                'file_type': random.choice(['image', 'pdf', 'document'])
-            })
-
-        elif event_type == 'mention':
-            base.update({
-                'channel_id': f'C{random.randint(10000, 99999)}',
-                'mentioned_user_id': f'user_{random.randint(1, 60):03d}',
-                'message_text': "Can you take a look at this when you get a chance?"
-            })
-
-        return base
+    # Users are processed in blocks of this size per day by the batch engine
+    USER_BLOCK_SIZE = 2000
 
-    @staticmethod
-    def generate_teams_event(user, event_type, timestamp):
-        """Generate Teams event payload"""
-        base = {
-            'user_name': user.name,
-            'user_id': user.id
-        }
+    # Events held in memory, across all blocks, while a day's blocks are merged
+    MERGE_BUFFER_EVENTS = 100000
 
-        if 'message' in event_type:
-            base.update({
-                'channel_id': f'T{random.randint(10000, 99999)}',
-                'message_text': random.choice([
-                    "Let's sync up this afternoon",
-                    "Sharing the latest metrics",
-                    "Who's available for a quick call?",
-                    "Updated the project timeline"
-                ])
-            })
-
-        elif 'meeting' in event_type:
-            base.update({
-                'meeting_id': f'M{random.randint(10000, 99999)}',
-                'meeting_title': random.choice([
-                    'Daily Standup', 'Sprint Planning', 'Team Sync',
-                    '1:1 Meeting', 'Design Review', 'Retrospective'
-                ]),
-                'duration_minutes': random.choice([15, 30, 60]),
-                'participants': random.randint(2, 8)
-            })
-
-        elif event_type == 'file.shared':
-            base.update({
-                'file_name': random.choice(['presentation.pptx', 'requirements.docx', 'budget.xlsx']),
-                'file_size_kb': random.randint(100, 5000)
-            })
-
-        return base
+    # Rendered lazy payloads kept in memory by render_payload
+    PAYLOAD_CACHE_SIZE = 10000
 
     @staticmethod
-    def generate_jira_event(user, event_type, timestamp):
-        """Generate Jira event payload"""
-        base = {
-            'user_name': user.name,
-            'user_id': user.id,
-            'issue_key': f'{random.choice(EventGenerator.PROJECTS)}-{random.randint(100, 999)}',
-            'project_id': random.choice(EventGenerator.PROJECTS)
-        }
-
-        if event_type == 'issue.created':
-            base.update({
-                'issue_type': random.choice(EventGenerator.ISSUE_TYPES),
-                'priority': random.choice(EventGenerator.PRIORITIES),
-                'summary': random.choice([
-                    'Implement user authentication',
-                    'Fix login page bug',
-                    'Update API documentation',
-                    'Optimize database queries'
-                ])
-            })
-
-        elif event_type == 'issue.status_changed':
-            base.update({
-                'from_status': random.choice(EventGenerator.STATUSES[:-1]),
-                'to_status': random.choice(EventGenerator.STATUSES[1:])
-            })
-
-        elif event_type == 'issue.commented':
-            base.update({
-                'comment': random.choice([
-                    'Working on this now',
-                    'Needs more clarification',
-                    'Ready for review',
-                    'Blocked by dependency'
-                ])
-            })
-
-        elif event_type == 'issue.assigned':
-            base.update({
-                'assigned_to': f'user_{random.randint(1, 60):03d}'
-            })
-
-        elif event_type == 'issue.priority_changed':
-            base.update({
-                'from_priority': random.choice(EventGenerator.PRIORITIES),
-                'to_priority': random.choice(EventGenerator.PRIORITIES)
-            })
-
-        return base
+    def get_sampler(platform):
+        """Return the precompiled PlatformSampler for a platform"""
+        sampler = EventGenerator.SAMPLERS.get(platform)
+        if sampler is None:
+            raise ValueError(f"Unknown platform: {platform}")
+        return sampler
 
     @staticmethod
-    def generate_event(user, platform, timestamp, source='daily'):
-        """Generate a single event for a user"""
-        if platform == 'slack':
-            event_type = EventGenerator.weighted_choice(EventGenerator.SLACK_EVENTS)
-            payload = EventGenerator.generate_slack_event(user, event_type, timestamp)
-            category = EventGenerator.SLACK_EVENTS[event_type]['category']
-
-        elif platform == 'teams':
-            event_type = EventGenerator.weighted_choice(EventGenerator.TEAMS_EVENTS)
-            payload = EventGenerator.generate_teams_event(user, event_type, timestamp)
-            category = EventGenerator.TEAMS_EVENTS[event_type]['category']
-
-        elif platform == 'jira':
-            event_type = EventGenerator.weighted_choice(EventGenerator.JIRA_EVENTS)
-            payload = EventGenerator.generate_jira_event(user, event_type, timestamp)
-            category = EventGenerator.JIRA_EVENTS[event_type]['category']
+    def generate_event(user, platform, timestamp, source='daily', lazy=False):
+        """Generate a single event for a user.
+
+        With ``lazy`` the payload is left empty and only its generation
+        parameters are kept in ``payload_params``; see render_payload.
+        """
+        event_type, category, template = EventGenerator.get_sampler(platform).sample()
 
+        if lazy:
+            payload = ''
+            payload_params = ','.join(map(str, template.draw_params()))
         else:
-            raise ValueError(f"Unknown platform: {platform}")
+            payload = template.render(user, timestamp)
+            payload_params = None
 
         return {
             'user_id': user.id,
@@ -218,26 +429,25 @@ class EventGenerator:
             'event_type': event_type,
             'event_category': category,
             'timestamp': timestamp,
-            'payload': json.dumps(payload),
+            'payload': payload,
+            'payload_params': payload_params,
             'consumed': False,
             'source': source
         }
 
     @staticmethod
-    def calculate_daily_events(user, platform):
-        """Calculate number of events per day for user on platform"""
-        pattern = BEHAVIOR_PATTERNS[user.behavior_pattern]
-
-        if platform == 'slack':
-            base_range = pattern['slack_daily']
-        elif platform == 'teams':
-            base_range = pattern['teams_daily']
-        elif platform == 'jira':
-            base_range = pattern['jira_daily']
-        else:
-            base_range = (5, 10)
-
-        return random.randint(base_range[0], base_range[1])
+    @lru_cache(maxsize=PAYLOAD_CACHE_SIZE)
+    def render_payload(platform, event_type, user_name, user_id, timestamp, payload_params):
+        """Render the JSON payload of a lazily stored event.
+
+        Results are kept in an LRU cache, so re-reading the same events does
+        not re-render them.
+        """
+        for entry_type, _, template in EventGenerator.get_sampler(platform).entries:
+            if entry_type == event_type:
+                params = [int(p) for p in payload_params.split(',')] if payload_params else []
+                return template.render_params(user_name, user_id, timestamp, params)
+        raise ValueError(f"Unknown {platform} event type: {event_type}")
 
     @staticmethod
     def is_working_hours(dt, start_hour=9, end_hour=18):
@@ -246,54 +456,285 @@ class EventGenerator:
                 start_hour <= dt.hour < end_hour)
 
     @staticmethod
-    def generate_historical_events(users, days=180, platforms=['slack', 'teams', 'jira']):
-        """Generate historical events for all users"""
+    def seconds_of_day(uniforms, patterns):
+        """Map uniforms to seconds after midnight via each user's activity curve.
+
+        ``patterns`` gives the behavior pattern index of every row. The hourly
+        weights of BEHAVIOR_PATTERNS[...]['hourly_activity'] form a piecewise
+        constant intensity; uniforms go through its inverse CDF, so the time
+        of day follows the curve and stays uniform within each hour.
+        """
+        seconds = np.empty(len(uniforms), dtype=np.int64)
+        for p, cdf in enumerate(ACTIVITY_CDFS):
+            rows = np.flatnonzero(patterns == p)
+            if not len(rows):
+                continue
+
+            u = uniforms[rows]
+            hours = np.minimum(np.searchsorted(cdf, u, side='right'), 23)
+            lower = np.where(hours > 0, cdf[hours - 1], 0.0)
+            within = (u - lower) / (cdf[hours] - lower)
+            seconds[rows] = hours * 3600 + np.minimum((within * 3600).astype(np.int64), 3599)
+        return seconds
+
+    @staticmethod
+    def slice_rng(seed, user_id, day, platform):
+        """Return the RNG stream for one (seed, user, day, platform) slice.
+
+        Every slice of history has its own independent stream, so any slice
+        can be regenerated on its own without replaying anything else.
+        """
+        entropy = [
+            int(seed),
+            int.from_bytes(user_id.encode(), 'little'),
+            day.toordinal(),
+            int.from_bytes(platform.encode(), 'little'),
+        ]
+        return np.random.default_rng(np.random.SeedSequence(entropy))
+
+    @staticmethod
+    def generate_day_batch(users, day, platforms, seed, source='historical', lazy=False):
+        """Generate one day of events for a block of users with NumPy.
+
+        Each (user, platform) slice draws its event count and a matrix of
+        uniforms from its own slice_rng stream; event types, times of day and
+        payload fields are then mapped for the whole block at once and Python
+        dicts are only built at the end. With ``lazy`` only the payload
+        generation parameters are produced, as in generate_event.
+
+        Times of day follow each user's behavior pattern activity curve and
+        the returned events are sorted by timestamp.
+        """
         events = []
+        if not users:
+            return events
+
+        user_patterns = np.array([PATTERN_INDEX[u.behavior_pattern] for u in users])
+
+        for platform in platforms:
+            sampler = EventGenerator.get_sampler(platform)
+            width = sampler.width
+
+            counts = []
+            blocks = []
+            for user in users:
+                low, high = BEHAVIOR_PATTERNS[user.behavior_pattern][f'{platform}_daily']
+                rng = EventGenerator.slice_rng(seed, user.id, day, platform)
+                count = int(rng.integers(low, high + 1))
+                counts.append(count)
+                blocks.append(rng.random((count, 2 + width)))
+
+            owners = np.repeat(np.arange(len(users)), counts)
+            if len(owners) == 0:
+                continue
+
+            draws = np.concatenate(blocks)
+            type_idx = sampler.sample_indices(draws[:, 0])
+            seconds = EventGenerator.seconds_of_day(draws[:, 1], user_patterns[owners])
+
+            user_slots = {}
+            for t, (event_type, category, template) in enumerate(sampler.entries):
+                rows = np.flatnonzero(type_idx == t)
+                if not len(rows):
+                    continue
+
+                block_users = [users[i] for i in owners[rows].tolist()]
+                times = [day + timedelta(seconds=s) for s in seconds[rows].tolist()]
+                if lazy:
+                    params = template.params_many(draws[rows, 2:])
+                    payloads = [''] * len(params)
+                else:
+                    payloads = template.render_many(block_users, times, draws[rows, 2:], user_slots)
+                    params = [None] * len(payloads)
+
+                for user, timestamp, payload, payload_params in zip(block_users, times, payloads, params):
+                    events.append({
+                        'user_id': user.id,
+                        'platform': platform,
+                        'event_type': event_type,
+                        'event_category': category,
+                        'timestamp': timestamp,
+                        'payload': payload,
+                        'payload_params': payload_params,
+                        'consumed': False,
+                        'source': source
+                    })
+
+        events.sort(key=itemgetter('timestamp'))
+        return events
+
+    @staticmethod
+    def new_seed():
+        """Pick a fresh random seed for a generation run"""
+        return int(np.random.SeedSequence().entropy)
+
+    @staticmethod
+    def generate_user_day(user, day, platform, seed, source='historical', lazy=False):
+        """Regenerate the events of one user on one platform for one day.
+
+        Returns exactly the events a historical run with the same seed
+        produced for that slice, in O(slice) time.
+        """
+        day = datetime.combine(day, datetime.min.time()) if not isinstance(day, datetime) else \
+            day.replace(hour=0, minute=0, second=0, microsecond=0)
+        return EventGenerator.generate_day_batch([user], day, [platform], seed, source=source, lazy=lazy)
+
+    @staticmethod
+    def generate_shard(users, day, block_index, platforms, seed, lazy=False, spill=None):
+        """Generate one (day, user block) shard of historical events
+
+        With ``spill`` = (directory, run size) the events are written there
+        with spill_shard() and the file's path is returned instead.
+        """
+        block_size = EventGenerator.USER_BLOCK_SIZE
+        block = users[block_index * block_size:(block_index + 1) * block_size]
+        events = EventGenerator.generate_day_batch(block, day, platforms, seed, lazy=lazy)
+        if spill is None:
+            return events
+
+        directory, run_size = spill
+        path = os.path.join(directory, f"{day.strftime('%Y%m%d')}-{block_index}.pickle")
+        return EventGenerator.spill_shard(events, path, run_size)
+
+    @staticmethod
+    def spill_shard(events, path, run_size):
+        """Write sorted events to ``path`` as consecutive pickled runs of ``run_size``"""
+        with open(path, 'wb') as f:
+            for start in range(0, len(events), run_size):
+                pickle.dump(events[start:start + run_size], f, pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @staticmethod
+    def read_spilled(path):
+        """Yield the events of a spilled shard, loading one run at a time, then delete the file"""
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    try:
+                        run = pickle.load(f)
+                    except EOFError:
+                        return
+                    yield from run
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    def merge_event_streams(streams):
+        """K-way heap merge of timestamp-sorted event streams into one sorted stream"""
+        if len(streams) == 1:
+            return iter(streams[0])
+        return heapq.merge(*streams, key=itemgetter('timestamp'))
+
+    @staticmethod
+    def _pooled_shards(pool, shards, window):
+        """Yield shard results in order, keeping at most ``window`` shards in flight"""
+        in_flight = deque()
+        for shard in shards:
+            in_flight.append(pool.apply_async(_generate_shard, (shard,)))
+            if len(in_flight) >= window:
+                yield in_flight.popleft().get()
+
+        while in_flight:
+            yield in_flight.popleft().get()
+
+    @staticmethod
+    def iter_historical_events(users, days=180, platforms=['slack', 'teams', 'jira'], seed=None,
+                               chunk_size=1000, workers=1, lazy=False):
+        """Yield historical events in lists of at most ``chunk_size`` events.
+
+        The (day, user block) space is split into shards that are generated
+        independently, in a process pool when ``workers`` > 1. Every
+        (user, day, platform) slice has its own RNG stream, so the output
+        does not depend on the worker count or block size. Shards come back
+        in order and only a bounded number are in flight at a time.
+
+        Each block is sorted by time and the blocks of a day are heap-merged,
+        so the chunks come out in global timestamp order across users and
+        platforms; each day ends with a short chunk rather than carrying
+        events into the next one. With more than one block, every block's day
+        is spilled to a temporary file by the process that generated it and
+        the merge reads one run per block, the runs shrinking as blocks are
+        added. Memory stays flat however many days or users there are, at
+        about MERGE_BUFFER_EVENTS events plus the shards in flight; the spill
+        files of a day take about as much disk as the day's events.
+        """
+        if seed is None:
+            seed = EventGenerator.new_seed()
         end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=days)
+        start_date = (end_date - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
 
-    #
-        print(f" DEBUG INFO:")
+        print(f"Generating {days} days of historical events for {len(users)} users...")
         print(f"   Start date: {start_date.strftime('%Y-%m-%d')}")
         print(f"   End date: {end_date.strftime('%Y-%m-%d')}")
-        print(f"   Total days: {(end_date - start_date).days}")
-        print(f"   Start weekday: {start_date.weekday()} (0=Mon, 6=Sun)")
-        print()
+        print(f"   Seed: {seed}")
+        print(f"   Workers: {workers}")
+
+        blocks = -(-len(users) // EventGenerator.USER_BLOCK_SIZE)
+        shards = [(start_date + timedelta(days=offset), block_index)
+                  for offset in range(days) for block_index in range(blocks)]
+
+        spill = None
+        if blocks > 1:
+            spill = (tempfile.mkdtemp(prefix='historical-'), max(1, EventGenerator.MERGE_BUFFER_EVENTS // blocks))
+
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer=_init_shard_worker,
+                                        initargs=(users, platforms, seed, lazy, spill))
+            results = EventGenerator._pooled_shards(pool, shards, window=workers * 2)
+        else:
+            results = (EventGenerator.generate_shard(users, day, block_index, platforms, seed, lazy, spill)
+                       for day, block_index in shards)
+
+        try:
+            day_streams = []
+            for (day, block_index), shard in zip(shards, results):
+                day_streams.append(EventGenerator.read_spilled(shard) if spill else shard)
+                if block_index < blocks - 1:
+                    continue
+
+                merged = EventGenerator.merge_event_streams(day_streams)
+                day_streams = []
+                while chunk := list(islice(merged, chunk_size)):
+                    yield chunk
+
+                if (day + timedelta(days=1)).day == 1:
+                    print(f"  Generated through {day.strftime('%Y-%m')}")
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if spill is not None:
+                shutil.rmtree(spill[0], ignore_errors=True)
 
-        print(f"Generating {days} days of historical events for {len(users)} users...")
+    @staticmethod
+    def generate_historical_events(users, days=180, platforms=['slack', 'teams', 'jira'], seed=None, workers=1):
+        """Generate historical events for all users"""
+        events = []
+        for chunk in EventGenerator.iter_historical_events(users, days, platforms, seed=seed, workers=workers):
+            events.extend(chunk)
 
-        current_date = start_date
-        days_processed = 0  #
+        print(f"Generated {len(events)} total historical events")
+        return events
 
-        while current_date < end_date:
-                days_processed += 1
 
-                if current_date.weekday() < 5:  # Weekdays only
-                    print(f"  Processing day {days_processed}: {current_date.strftime('%Y-%m-%d')}")
+EventGenerator.SAMPLERS = {
+    'slack': PlatformSampler(EventGenerator.SLACK_EVENTS, EventGenerator.PAYLOAD_FIELDS['slack']),
+    'teams': PlatformSampler(EventGenerator.TEAMS_EVENTS, EventGenerator.PAYLOAD_FIELDS['teams']),
+    'jira': PlatformSampler(EventGenerator.JIRA_EVENTS, EventGenerator.PAYLOAD_FIELDS['jira']),
+}
 
-                for user in users:
-                    for platform in platforms:
-                        daily_events = EventGenerator.calculate_daily_events(user, platform)
 
-                        for _ in range(daily_events):
-                            hour = random.randint(9, 17)
-                            minute = random.randint(0, 59)
-                            event_time = current_date.replace(
-                                hour=hour,
-                                minute=minute,
-                                second=random.randint(0, 59)
-                            )
+# Process pool state for sharded historical generation
+_shard_state = {}
 
-                            event = EventGenerator.generate_event(
-                                user, platform, event_time, source='historical'
-                            )
-                            events.append(event)
 
-                current_date += timedelta(days=1)
+def _init_shard_worker(users, platforms, seed, lazy, spill):
+    _shard_state.update(users=users, platforms=platforms, seed=seed, lazy=lazy, spill=spill)
 
-        if current_date.day == 1:
-            print(f"  Generated through {current_date.strftime('%Y-%m')}")
 
-        print(f"\n Total days processed: {days_processed}")
-        print(f"Generated {len(events)} total historical events")
-        return events
\ No newline at end of file
+def _generate_shard(shard):
+    day, block_index = shard
+    return EventGenerator.generate_shard(
+        _shard_state['users'], day, block_index, _shard_state['platforms'], _shard_state['seed'],
+        _shard_state['lazy'], _shard_state['spill']
+    )
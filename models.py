@@ -1,10 +1,46 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import UnaryExpression
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import chain, islice
+import base64
+import heapq
 import json
-import uuid
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from event_generator import EventGenerator
 
 db = SQLAlchemy()
 
+# JSON string literals of the short repeated values in event envelopes
+quote_json = lru_cache(maxsize=65536)(json.dumps)
+
+
+def configure_sqlite(app):
+    """Apply app.config['SQLITE_PRAGMAS'] to every new SQLite connection"""
+    pragmas = app.config['SQLITE_PRAGMAS']
+
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', set_pragmas)
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -30,31 +66,940 @@ class User(db.Model):
 class Event(db.Model):
     __tablename__ = 'events'
 
-    id = db.Column(db.String(50), primary_key=True, default=lambda: f"evt_{uuid.uuid4().hex[:12]}")
-    user_id = db.Column(db.String(50), db.ForeignKey('users.id'), nullable=False)
+    # Monotonic integer key (the rowid on SQLite), so inserts append to the
+    # primary key B-tree; the public event_id is derived from it
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    # Checked at commit, so users can be re-seeded under existing events
+    user_id = db.Column(db.String(50), db.ForeignKey('users.id', deferrable=True, initially='DEFERRED'),
+                        nullable=False)
     platform = db.Column(db.String(20), nullable=False)  # slack, teams, jira
     event_type = db.Column(db.String(50), nullable=False)
     event_category = db.Column(db.String(50), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, index=True)
-    payload = db.Column(db.Text, nullable=False)  # JSON string
+    payload = db.Column(db.Text, nullable=False)  # JSON string, '' when stored lazily
+    payload_params = db.Column(db.String(100))  # generation parameters of a lazy payload
     consumed = db.Column(db.Boolean, default=False, index=True)
     source = db.Column(db.String(20), default='daily')  # historical, daily, manual
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set while a leased poll holds the event; redelivered once leased_until passes
+    lease_id = db.Column(db.String(32))
+    leased_until = db.Column(db.DateTime)
 
     user = db.relationship('User', backref='events')
 
-    def to_dict(self):
+    __table_args__ = (
+        # Serves the polling query: platform=X AND consumed=false ORDER BY timestamp LIMIT n
+        db.Index('ix_events_platform_consumed_timestamp', 'platform', 'consumed', 'timestamp'),
+        # Finds a lease's events on ack; only events under a lease are indexed
+        db.Index('ix_events_lease_id', 'lease_id',
+                 sqlite_where=db.text('lease_id IS NOT NULL'),
+                 postgresql_where=db.text('lease_id IS NOT NULL')),
+        # Never reuse ids of deleted rows, so public ids stay unique
+        {'sqlite_autoincrement': True},
+    )
+
+    @property
+    def public_id(self):
+        return Event.format_public_id(self.id)
+
+    @staticmethod
+    def format_public_id(event_id):
+        """Render a storage id in the public 'evt_' + 12 hex digits format"""
+        return f"evt_{event_id:012x}"
+
+    @staticmethod
+    def parse_public_id(public_id):
+        """Return the storage id for a public event id, or None if malformed"""
+        if not isinstance(public_id, str) or not public_id.startswith('evt_'):
+            return None
+        try:
+            return int(public_id[4:], 16)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def payload_text(row, user_name):
+        """Return the payload JSON text of an events row, rendering it if stored lazily"""
+        if row.payload_params is None:
+            return row.payload
+        return EventGenerator.render_payload(
+            row.platform, row.event_type, user_name, row.user_id,
+            row.timestamp, row.payload_params
+        )
+
+    @staticmethod
+    def row_to_dict(row, user_name):
+        """to_dict() for an events row read from any partition"""
         return {
-            'event_id': self.id,
-            'user_id': self.user_id,
-            'platform': self.platform,
-            'event_type': self.event_type,
-            'event_category': self.event_category,
-            'timestamp': self.timestamp.isoformat() + 'Z',
-            'payload': json.loads(self.payload),
-            'consumed': self.consumed,
-            'source': self.source
+            'event_id': Event.format_public_id(row.id),
+            'user_id': row.user_id,
+            'platform': row.platform,
+            'event_type': row.event_type,
+            'event_category': row.event_category,
+            'timestamp': row.timestamp.isoformat() + 'Z',
+            'payload': json.loads(Event.payload_text(row, user_name)),
+            'consumed': row.consumed,
+            'source': row.source
+        }
+
+    # to_dict() as JSON, keys in jsonify's order; the payload text is spliced in as stored
+    JSON_ENVELOPE = (
+        '{"consumed":%s,"event_category":%s,"event_id":"evt_%012x","event_type":%s,'
+        '"payload":%s,"platform":%s,"source":%s,"timestamp":"%sZ","user_id":%s}'
+    )
+
+    @staticmethod
+    def row_to_json(row, user_name, consumed):
+        """to_dict() of an events row encoded as JSON, without decoding the payload"""
+        return Event.JSON_ENVELOPE % (
+            'true' if consumed else 'false',
+            quote_json(row.event_category),
+            row.id,
+            quote_json(row.event_type),
+            Event.payload_text(row, user_name),
+            quote_json(row.platform),
+            quote_json(row.source),
+            row.timestamp.isoformat(),
+            quote_json(row.user_id),
+        )
+
+    def render_payload(self):
+        """Return the payload JSON text, rendering it if stored lazily"""
+        return Event.payload_text(self, self.user.name)
+
+    def to_dict(self):
+        return Event.row_to_dict(self, self.user.name)
+
+
+# ============================================================================
+# Monthly event partitions
+# ============================================================================
+#
+# With EVENT_PARTITIONING = 'monthly' events are stored in one table per
+# calendar month of their timestamp (events_2026_01, ...), created on first
+# write. The events table itself keeps rows written before partitioning was
+# enabled. Ids of a partition start at its month index << PARTITION_ID_SHIFT,
+# so public ids stay unique across tables. event_partitions registers every
+# partition, and outlives dropped ones so their ids are never issued again.
+
+PARTITION_ID_SHIFT = 32
+PARTITION_NAME = re.compile(r'^events_(\d{4})_(\d{2})$')
+
+
+def partitioning_enabled():
+    return current_app.config['EVENT_PARTITIONING'] == 'monthly'
+
+
+def month_index(timestamp):
+    """Months since year 0 of a timestamp"""
+    return timestamp.year * 12 + timestamp.month - 1
+
+
+def month_start(index):
+    """First instant of a month index"""
+    year, month = divmod(index, 12)
+    return datetime(year, month + 1, 1)
+
+
+def partition_name(index):
+    year, month = divmod(index, 12)
+    return f'events_{year:04d}_{month + 1:02d}'
+
+
+def _partition_table(index):
+    """Return the Table of a month partition, defining it on first use"""
+    name = partition_name(index)
+    table = db.metadata.tables.get(name)
+    if table is None:
+        table = Event.__table__.to_metadata(db.metadata, name=name)
+        for table_index in table.indexes:
+            if not table_index.name.startswith(f'ix_{name}_'):
+                table_index.name = table_index.name.replace('ix_events_', f'ix_{name}_', 1)
+    return table
+
+
+def _partition_month(name):
+    """Month index of a partition table name, or None for other tables"""
+    match = PARTITION_NAME.match(name)
+    if not match:
+        return None
+    return int(match[1]) * 12 + int(match[2]) - 1
+
+
+class EventPartition(db.Model):
+    """A month partition; the row stays when the table is dropped"""
+    __tablename__ = 'event_partitions'
+
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # Last id issued by the partition when it was dropped; a re-created
+    # month continues above it
+    high_water = db.Column(db.BigInteger, nullable=False, default=0)
+    dropped_at = db.Column(db.DateTime)
+
+
+# (time.monotonic() of the last read, live month indexes, oldest first)
+_partition_cache = (None, [])
+
+
+def _partition_indexes(refresh=False):
+    """Month indexes of the live partitions, oldest first
+
+    The list is read from event_partitions at most every
+    PARTITION_CACHE_SECONDS per process, so polls don't query the schema.
+    """
+    global _partition_cache
+    loaded, months = _partition_cache
+    if refresh or loaded is None or time.monotonic() - loaded > current_app.config['PARTITION_CACHE_SECONDS']:
+        months = list(db.session.execute(
+            db.select(EventPartition.month).where(EventPartition.dropped_at.is_(None)).order_by(EventPartition.month)
+        ).scalars())
+        _partition_cache = (time.monotonic(), months)
+    return months
+
+
+def _cache_partition(index, live):
+    global _partition_cache
+    loaded, months = _partition_cache
+    months = sorted(set(months) | {index} if live else set(months) - {index})
+    _partition_cache = (loaded, months)
+
+
+def _register_partitions():
+    """Register partition tables created before event_partitions existed"""
+    months = {_partition_month(name) for name in db.inspect(db.session.connection()).get_table_names()}
+    registered = set(db.session.execute(db.select(EventPartition.month)).scalars())
+    for index in months - registered - {None}:
+        db.session.add(EventPartition(month=index, high_water=0))
+    db.session.commit()
+    _partition_indexes(refresh=True)
+
+
+def event_tables(start=None, end=None):
+    """Event tables that can hold rows with start <= timestamp < end, oldest first
+
+    The unpartitioned events table always comes first.
+    """
+    tables = [Event.__table__]
+    if not partitioning_enabled():
+        return tables
+
+    first = month_index(start) if start else None
+    last = month_index(end - timedelta(microseconds=1)) if end else None
+    for index in _partition_indexes():
+        if (first is None or index >= first) and (last is None or index <= last):
+            tables.append(_partition_table(index))
+    return tables
+
+
+def partition_for(timestamp):
+    """Table an event with this timestamp is written to, created if missing"""
+    if not partitioning_enabled():
+        return Event.__table__
+
+    index = month_index(timestamp)
+    table = _partition_table(index)
+    if index in _partition_indexes():
+        return table
+
+    # Register the month, or revive it if it was dropped; either way this
+    # transaction is the one that creates the table
+    connection = db.session.connection()
+    partitions = EventPartition.__table__
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    created = connection.execute(
+        dialect.insert(partitions).values(month=index, high_water=0).on_conflict_do_nothing()
+    ).rowcount or connection.execute(
+        partitions.update()
+        .where(partitions.c.month == index, partitions.c.dropped_at.is_not(None))
+        .values(dropped_at=None)
+    ).rowcount
+
+    connection.execute(CreateTable(table, if_not_exists=True))
+    for table_index in table.indexes:
+        connection.execute(CreateIndex(table_index, if_not_exists=True))
+
+    if created:
+        # Start the id sequence at the month's id range, above any ids a
+        # dropped table of the same month issued
+        high_water = connection.execute(
+            db.select(partitions.c.high_water).where(partitions.c.month == index)
+        ).scalar()
+        _seed_sequence(connection, table, max(index << PARTITION_ID_SHIFT, high_water))
+    _cache_partition(index, live=True)
+    return table
+
+
+def _seed_sequence(connection, table, last_id):
+    """Make the next id of a partition above ``last_id``, never lowering it"""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(db.text(
+            'INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq '
+            'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)'
+        ), {'name': table.name, 'seq': last_id})
+        connection.execute(db.text(
+            'UPDATE sqlite_sequence SET seq = max(seq, :seq) WHERE name = :name'
+        ), {'name': table.name, 'seq': last_id})
+    else:
+        connection.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence(:name, 'id'), "
+            "GREATEST(:seq, nextval(pg_get_serial_sequence(:name, 'id'))))"
+        ), {'name': table.name, 'seq': last_id})
+
+
+def _last_issued_id(connection, table):
+    """Last id a partition's sequence handed out, 0 if none"""
+    if connection.dialect.name == 'sqlite':
+        query = 'SELECT seq FROM sqlite_sequence WHERE name = :name'
+    else:
+        query = "SELECT pg_sequence_last_value(pg_get_serial_sequence(:name, 'id')::regclass)"
+    return connection.execute(db.text(query), {'name': table.name}).scalar() or 0
+
+
+def _event_criteria(table, start, end, filters):
+    criteria = [table.c[name] == value for name, value in filters.items()]
+    if start is not None:
+        criteria.append(table.c.timestamp >= start)
+    if end is not None:
+        criteria.append(table.c.timestamp < end)
+    return criteria
+
+
+def count_events(start=None, end=None, **filters):
+    """Count events by column values, reading only partitions in [start, end)"""
+    total = 0
+    for table in event_tables(start, end):
+        query = db.select(db.func.count()).select_from(table).where(*_event_criteria(table, start, end, filters))
+        total += db.session.execute(query).scalar()
+    return total
+
+
+def delete_events(start=None, end=None, **filters):
+    """Delete events by column values in [start, end); returns the row count"""
+    deleted = 0
+    for table in event_tables(start, end):
+        criteria = _event_criteria(table, start, end, filters)
+        bump_counters(grouped_counts(table, criteria), sign=-1)
+        result = db.session.execute(table.delete().where(*criteria))
+        deleted += result.rowcount
+    return deleted
+
+
+def delete_orphaned_events():
+    """Delete events whose user no longer exists; returns the row count"""
+    deleted = 0
+    user_ids = db.select(User.__table__.c.id)
+    for table in event_tables():
+        criteria = [table.c.user_id.not_in(user_ids)]
+        bump_counters(grouped_counts(table, criteria), sign=-1)
+        deleted += db.session.execute(table.delete().where(*criteria)).rowcount
+    return deleted
+
+
+POLL_COLUMNS = (
+    'id', 'user_id', 'platform', 'event_type', 'event_category', 'timestamp',
+    'payload', 'payload_params', 'source'
+)
+
+
+def poll_events(platform, limit, lease=None):
+    """Consume the oldest unconsumed events of a platform, each as a JSON object string
+
+    Partitions are read oldest first and the scan stops once ``limit``
+    events are found, so a poll normally touches one or two partitions.
+    Only the columns of the envelope are loaded, as plain row tuples.
+    With a ``lease`` from new_lease() the events are leased instead of
+    consumed, and stay unconsumed until ack_events().
+    """
+    events = []
+    for table in event_tables():
+        remaining = limit - len(events)
+        if remaining <= 0:
+            break
+
+        rows = claim_events(table, platform, remaining, lease)
+        names = _lazy_user_names(rows)
+        events.extend(Event.row_to_json(row, names.get(row.user_id), lease is None) for row in rows)
+
+    db.session.commit()
+    return events
+
+
+def browse_events(platform, limit, after=None):
+    """Unconsumed events of a platform after the (timestamp, id) key ``after``, without consuming them
+
+    Keyset pagination: each table read is an index range scan of at most
+    ``limit`` + 1 rows starting at the key, however deep the page, and only
+    partitions from the key's month on are read.
+    Returns (event JSON strings, key of the last event or None on the last page).
+    """
+    rows = []
+    found_in_partitions = 0
+    for table in event_tables(start=after[0] if after else None):
+        if found_in_partitions > limit:
+            break
+
+        query = (
+            db.select(*(table.c[name] for name in POLL_COLUMNS))
+            .where(table.c.platform == platform, table.c.consumed == False)
+            .order_by(table.c.timestamp.asc(), table.c.id.asc())
+            .limit(limit + 1)
+        )
+        if after:
+            query = query.where(db.tuple_(table.c.timestamp, table.c.id) > after)
+        table_rows = db.session.execute(query).all()
+
+        rows.extend(table_rows)
+        if table is not Event.__table__:
+            found_in_partitions += len(table_rows)
+
+    # The unpartitioned table can overlap the partitions in time
+    rows.sort(key=lambda row: (row.timestamp, row.id))
+    page = rows[:limit]
+    names = _lazy_user_names(page)
+    events = [Event.row_to_json(row, names.get(row.user_id), False) for row in page]
+    next_key = (page[-1].timestamp, page[-1].id) if page and len(rows) > limit else None
+    return events, next_key
+
+
+def export_events(platform, limit, after=None):
+    """Generator form of browse_events() for large reads
+
+    Rows come from the database EXPORT_FETCH_ROWS at a time (a server-side
+    cursor on PostgreSQL) and are encoded as they go, so memory stays flat
+    however large ``limit`` is. Partitions are read one after another,
+    merged with the unpartitioned table, which can overlap them in time.
+    Yields event JSON strings in (timestamp, id) order.
+    """
+    if limit < 1:
+        return
+    tables = event_tables(start=after[0] if after else None)
+    merged = heapq.merge(
+        _export_table(tables[0], platform, limit, after),
+        chain.from_iterable(_export_table(table, platform, limit, after) for table in tables[1:]),
+    )
+    for _, _, event in islice(merged, limit):
+        yield event
+
+
+def _export_table(table, platform, limit, after):
+    query = (
+        db.select(*(table.c[name] for name in POLL_COLUMNS))
+        .where(table.c.platform == platform, table.c.consumed == False)
+        .order_by(table.c.timestamp.asc(), table.c.id.asc())
+        .limit(limit)
+        .execution_options(yield_per=current_app.config['EXPORT_FETCH_ROWS'])
+    )
+    if after:
+        query = query.where(db.tuple_(table.c.timestamp, table.c.id) > after)
+
+    with db.session.execute(query) as result:
+        for rows in result.partitions():
+            names = _lazy_user_names(rows)
+            for row in rows:
+                yield row.timestamp, row.id, Event.row_to_json(row, names.get(row.user_id), False)
+
+
+def stream_events(platform, after_id, limit):
+    """Events of a platform with ids above ``after_id``, in id order
+
+    This is the read behind the live stream. It is a primary key range
+    scan, starting at the partition ``after_id`` came from.
+    Returns (id, event JSON string) pairs.
+
+    On PostgreSQL ids are drawn at insert, not at commit, so an event whose
+    transaction commits after one with a higher id has been read is skipped.
+    EventWriter commits each batch promptly, which keeps that window short;
+    clients that must see every event should poll instead.
+    """
+    month = after_id >> PARTITION_ID_SHIFT
+    sqlite_planner = db.engine.dialect.name == 'sqlite'
+    rows = []
+    for table in event_tables():
+        if len(rows) >= limit:
+            break
+        if table is Event.__table__ and month > 0:
+            continue
+        if table is not Event.__table__ and _partition_month(table.name) < month:
+            continue
+
+        platform_column = table.c.platform
+        if sqlite_planner:
+            # Unary + keeps SQLite on the rowid range: partitions are never
+            # ANALYZEd, and without statistics it picks a platform index and
+            # sorts the platform's whole month instead
+            platform_column = UnaryExpression(platform_column, operator=operators.custom_op('+'),
+                                              type_=platform_column.type)
+
+        rows.extend(db.session.execute(
+            db.select(*(table.c[name] for name in POLL_COLUMNS), table.c.consumed)
+            .where(platform_column == platform, table.c.id > after_id)
+            .order_by(table.c.id.asc())
+            .limit(limit - len(rows))
+        ).all())
+
+    names = _lazy_user_names(rows)
+    return [(row.id, Event.row_to_json(row, names.get(row.user_id), row.consumed)) for row in rows]
+
+
+def latest_event_id():
+    """Highest event id issued so far, 0 if there are no events"""
+    for table in reversed(event_tables()):
+        latest = db.session.execute(db.select(db.func.max(table.c.id))).scalar()
+        if latest is not None:
+            return latest
+    return 0
+
+
+def encode_cursor(key):
+    """Opaque page cursor for a (timestamp, id) key"""
+    timestamp, event_id = key
+    text = f'{timestamp.isoformat()}|{event_id:x}'
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) key of a page cursor, or None if malformed"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, event_id = text.split('|')
+        return datetime.fromisoformat(timestamp), int(event_id, 16)
+    except ValueError:
+        return None
+
+
+def new_lease(seconds):
+    """(lease_id, leased_until) for a leased poll"""
+    return secrets.token_hex(16), datetime.utcnow() + timedelta(seconds=seconds)
+
+
+def claim_events(table, platform, limit, lease=None):
+    """Claim the oldest ``limit`` available events of a table and return them
+
+    Available means unconsumed and not under an unexpired lease. Claimed
+    events are marked consumed, or leased when a ``lease`` is given.
+
+    This is one UPDATE ... RETURNING over a locked subquery. On PostgreSQL
+    the subquery uses FOR UPDATE SKIP LOCKED, so concurrent polls get
+    disjoint batches without waiting on each other. On SQLite the UPDATE
+    takes the write lock before it reads, so two polls never claim the
+    same rows.
+    """
+    oldest = (
+        db.select(table.c.id)
+        .where(
+            table.c.platform == platform,
+            table.c.consumed == False,
+            db.or_(table.c.leased_until == None, table.c.leased_until < datetime.utcnow())
+        )
+        .order_by(table.c.timestamp.asc())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    if lease is None:
+        values = {'consumed': True, 'lease_id': None, 'leased_until': None}
+    else:
+        values = {'lease_id': lease[0], 'leased_until': lease[1]}
+    rows = db.session.execute(
+        table.update()
+        .where(table.c.id.in_(oldest))
+        .values(**values)
+        .returning(*(table.c[name] for name in POLL_COLUMNS))
+    ).all()
+
+    if lease is None:
+        bump_counters(tally_events(
+            ((row.timestamp, row.platform, row.source, True) for row in rows), count_total=False
+        ))
+    # RETURNING gives no order guarantee
+    rows.sort(key=lambda row: (row.timestamp, row.id))
+    return rows
+
+
+def ack_events(lease_id, event_ids=None):
+    """Mark the events of a lease consumed; returns how many were acknowledged
+
+    ``event_ids`` (storage ids) limits the ack to part of the lease. Events
+    whose lease expired and were claimed again by another poll belong to
+    that poll's lease and are left alone.
+    """
+    if event_ids is None:
+        targets = [(table, None) for table in event_tables()]
+    else:
+        by_table = {}
+        for event_id in event_ids:
+            table = table_for_id(event_id)
+            if table is not None:
+                by_table.setdefault(table.name, (table, []))[1].append(event_id)
+        targets = list(by_table.values())
+
+    acked = 0
+    for table, ids in targets:
+        criteria = [table.c.lease_id == lease_id, table.c.consumed == False]
+        if ids is not None:
+            criteria.append(table.c.id.in_(ids))
+        rows = db.session.execute(
+            table.update()
+            .where(*criteria)
+            .values(consumed=True, lease_id=None, leased_until=None)
+            .returning(table.c.timestamp, table.c.platform, table.c.source)
+        ).all()
+        bump_counters(tally_events(
+            ((row.timestamp, row.platform, row.source, True) for row in rows), count_total=False
+        ))
+        acked += len(rows)
+
+    db.session.commit()
+    return acked
+
+
+def table_for_id(event_id):
+    """Event table an id was issued by, or None if its partition is gone"""
+    index = event_id >> PARTITION_ID_SHIFT
+    if index == 0:
+        return Event.__table__
+    if index not in _partition_indexes() and index not in _partition_indexes(refresh=True):
+        return None
+    return _partition_table(index)
+
+
+def _lazy_user_names(rows):
+    """{user_id: name} for the rows whose payloads are rendered on fetch"""
+    user_ids = {row.user_id for row in rows if row.payload_params is not None}
+    if not user_ids:
+        return {}
+    users = User.__table__
+    return dict(db.session.execute(
+        db.select(users.c.id, users.c.name).where(users.c.id.in_(user_ids))
+    ).all())
+
+
+def drop_expired_partitions(cutoff):
+    """Drop partitions whose whole month lies before ``cutoff`` and is consumed
+
+    Partitions still holding unconsumed events, the month containing the
+    cutoff and the unpartitioned table are left for row-level retention.
+    Partitions are first marked dropped in event_partitions, and the tables
+    go only once every process has reread its partition list, so no poll
+    reads a missing table. Returns (events removed, partitions dropped).
+    """
+    partitions = EventPartition.__table__
+    expired = [
+        table for table in event_tables(end=cutoff)[1:]
+        if month_start(_partition_month(table.name) + 1) <= cutoff and not _has_unconsumed(table)
+    ]
+    for table in expired:
+        index = _partition_month(table.name)
+        db.session.execute(
+            partitions.update().where(partitions.c.month == index).values(dropped_at=datetime.utcnow())
+        )
+        _cache_partition(index, live=False)
+    db.session.commit()
+    if not expired:
+        return 0, 0
+
+    time.sleep(2 * current_app.config['PARTITION_CACHE_SECONDS'])
+
+    removed = dropped = 0
+    connection = db.session.connection()
+    for table in expired:
+        index = _partition_month(table.name)
+        revived = connection.execute(
+            db.select(partitions.c.dropped_at).where(partitions.c.month == index)
+        ).scalar() is None
+        if revived:
+            continue
+        if _has_unconsumed(table):
+            # Written to by a process that still had it listed
+            connection.execute(partitions.update().where(partitions.c.month == index).values(dropped_at=None))
+            continue
+
+        counts = grouped_counts(table)
+        bump_counters(counts, sign=-1)
+        removed += sum(total for total, consumed in counts.values())
+        connection.execute(
+            partitions.update().where(partitions.c.month == index)
+            .values(high_water=_last_issued_id(connection, table))
+        )
+        table.drop(bind=connection)
+        db.metadata.remove(table)
+        dropped += 1
+
+    db.session.commit()
+    _partition_indexes(refresh=True)
+    return removed, dropped
+
+
+def _has_unconsumed(table):
+    return db.session.execute(
+        db.select(table.c.id).where(table.c.consumed == False).limit(1)
+    ).first() is not None
+
+
+# ============================================================================
+# Event counters
+# ============================================================================
+
+class EventCounter(db.Model):
+    """Event totals per day, platform and source, kept in step with the
+    event tables so stats never have to count events"""
+    __tablename__ = 'event_counters'
+
+    day = db.Column(db.Date, primary_key=True)
+    platform = db.Column(db.String(20), primary_key=True)
+    source = db.Column(db.String(20), primary_key=True)
+    total = db.Column(db.BigInteger, nullable=False, default=0)
+    consumed = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+def tally_events(events, count_total=True):
+    """Counter deltas for (timestamp, platform, source, consumed) tuples"""
+    deltas = {}
+    for timestamp, platform, source, consumed in events:
+        key = (timestamp.date(), platform, source or 'daily')
+        total, done = deltas.get(key, (0, 0))
+        deltas[key] = (total + count_total, done + bool(consumed))
+    return deltas
+
+
+def grouped_counts(table, criteria=()):
+    """Counter values of the rows of an event table matching ``criteria``"""
+    day = db.func.date(table.c.timestamp)
+    rows = db.session.execute(
+        db.select(day, table.c.platform, table.c.source,
+                  db.func.count(), db.func.sum(db.cast(table.c.consumed, db.Integer)))
+        .where(*criteria)
+        .group_by(day, table.c.platform, table.c.source)
+    ).all()
+    return {
+        (_as_date(day), platform, source or 'daily'): (total, consumed or 0)
+        for day, platform, source, total, consumed in rows
+    }
+
+
+def _as_date(value):
+    # SQLite returns date() as text
+    return datetime.strptime(value, '%Y-%m-%d').date() if isinstance(value, str) else value
+
+
+def bump_counters(deltas, sign=1):
+    """Add {(day, platform, source): (total, consumed)} deltas in the current transaction"""
+    if not deltas:
+        return
+
+    table = EventCounter.__table__
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    insert = dialect.insert(table)
+    db.session.execute(
+        insert.on_conflict_do_update(
+            index_elements=['day', 'platform', 'source'],
+            set_={
+                'total': table.c.total + insert.excluded.total,
+                'consumed': table.c.consumed + insert.excluded.consumed,
+            }
+        ),
+        [
+            {'day': day, 'platform': platform, 'source': source,
+             'total': sign * total, 'consumed': sign * consumed}
+            # Sorted, so concurrent transactions lock counter rows in one order
+            for (day, platform, source), (total, consumed) in sorted(deltas.items())
+        ]
+    )
+
+
+def counter_totals(by, day=None):
+    """{value of column ``by``: (total, consumed)} from event_counters"""
+    column = EventCounter.__table__.c[by]
+    query = db.select(column, db.func.sum(EventCounter.total), db.func.sum(EventCounter.consumed)).group_by(column)
+    if day is not None:
+        query = query.where(EventCounter.day == day)
+    return {key: (int(total), int(consumed)) for key, total, consumed in db.session.execute(query)}
+
+
+def reconcile_counters():
+    """Correct event_counters from the event tables, one day at a time
+
+    Each day is recounted in its own short transaction, which first touches
+    that day's counter rows: this takes the write lock on SQLite and the
+    rows' locks on PostgreSQL, so writers wait for one day's recount rather
+    than the whole database's. Only the differences are written.
+    Returns the number of events counted.
+    """
+    counters = EventCounter.__table__
+    days = set(db.session.execute(db.select(counters.c.day).distinct()).scalars())
+    for table in event_tables():
+        first, last = db.session.execute(
+            db.select(db.func.min(table.c.timestamp), db.func.max(table.c.timestamp))
+        ).one()
+        if first is not None:
+            days.update(first.date() + timedelta(days=offset) for offset in range((last.date() - first.date()).days + 1))
+    db.session.commit()
+
+    counted = 0
+    for day in sorted(days):
+        db.session.execute(counters.update().where(counters.c.day == day).values(total=counters.c.total))
+
+        start = datetime.combine(day, datetime.min.time())
+        end = start + timedelta(days=1)
+        counts = {}
+        for table in event_tables(start, end):
+            criteria = [table.c.timestamp >= start, table.c.timestamp < end]
+            for key, (total, consumed) in grouped_counts(table, criteria).items():
+                previous = counts.get(key, (0, 0))
+                counts[key] = (previous[0] + total, previous[1] + consumed)
+
+        current = {
+            (day, platform, source): (total, consumed)
+            for platform, source, total, consumed in db.session.execute(
+                db.select(counters.c.platform, counters.c.source, counters.c.total, counters.c.consumed)
+                .where(counters.c.day == day)
+            )
         }
+        deltas = {}
+        for key in set(counts) | set(current):
+            total, consumed = counts.get(key, (0, 0))
+            old_total, old_consumed = current.get(key, (0, 0))
+            if (total, consumed) != (old_total, old_consumed):
+                deltas[key] = (total - old_total, consumed - old_consumed)
+        bump_counters(deltas)
+        db.session.execute(counters.delete().where(
+            counters.c.day == day, counters.c.total == 0, counters.c.consumed == 0
+        ))
+        db.session.commit()
+        counted += sum(total for total, consumed in counts.values())
+    return counted
+
+
+class EventNotifier:
+    """Wakes long-polling requests in this process when events are committed
+
+    Each platform has a version that EventWriter bumps after each commit;
+    a waiter sleeps until the version differs from the one it saw before
+    its last (empty) read.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = {}
+        self._watching = False
+
+    def version(self, platform):
+        with self._condition:
+            return self._versions.get(platform, 0)
+
+    def notify(self, platforms):
+        with self._condition:
+            for platform in platforms:
+                self._versions[platform] = self._versions.get(platform, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, platform, version, timeout):
+        """Block until ``platform`` moves past ``version``; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._versions.get(platform, 0) != version, timeout)
+
+    def watch(self, app):
+        """Start, once per process, a thread that notifies for other processes' writes
+
+        Writers elsewhere (the scheduler, setup) can't reach this process's
+        condition, so the thread reads today's per-platform totals from
+        event_counters every EVENT_WATCH_INTERVAL_SECONDS - one small read
+        for the whole process - and notifies the platforms whose totals
+        grew.
+        """
+        with self._condition:
+            if self._watching:
+                return
+            self._watching = True
+        threading.Thread(target=self._watch, args=(app,), daemon=True).start()
+
+    def _watch(self, app):
+        interval = app.config['EVENT_WATCH_INTERVAL_SECONDS']
+        seen = None
+        while True:
+            try:
+                with app.app_context():
+                    # Only inserts wake waiters, not polls consuming events
+                    totals = {
+                        platform: total
+                        for platform, (total, consumed) in counter_totals('platform', day=datetime.utcnow().date()).items()
+                    }
+                if seen is not None:
+                    moved = [platform for platform, total in totals.items() if total > seen.get(platform, 0)]
+                    if moved:
+                        self.notify(moved)
+                seen = totals
+            except Exception as e:
+                print(f"Event watcher error: {e}")
+            time.sleep(interval)
+
+
+event_notifier = EventNotifier()
+
+
+class EventWriter:
+    """Bulk writer for generated event dicts.
+
+    Rows go through one SQLAlchemy Core executemany per batch instead of an
+    ORM object per row; ids come from the database and created_at is filled
+    in once per batch.
+    Commits happen every ``commit_rows`` rows and on flush()/exit, in the
+    current db.session transaction, and wake long-polls for the platforms
+    written.
+    """
+
+    def __init__(self, batch_size=None, commit_rows=None):
+        self.batch_size = batch_size or current_app.config['EVENT_INSERT_BATCH_SIZE']
+        self.commit_rows = commit_rows or current_app.config['EVENT_INSERT_COMMIT_ROWS']
+        self.written = 0
+        self._uncommitted = 0
+        self._platforms = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            db.session.rollback()
+            self._platforms.clear()
+
+    def write(self, events):
+        """Insert a list of event dicts as produced by EventGenerator"""
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            now = datetime.utcnow()
+            rows = [dict(event, created_at=now) for event in batch]
+            for table, partition_rows in self._route(rows):
+                db.session.execute(table.insert(), partition_rows)
+            bump_counters(tally_events(
+                (row['timestamp'], row['platform'], row.get('source'), row.get('consumed')) for row in rows
+            ))
+
+            self._platforms.update(row['platform'] for row in rows)
+            self.written += len(rows)
+            self._uncommitted += len(rows)
+            if self._uncommitted >= self.commit_rows:
+                self.flush()
+
+    @staticmethod
+    def _route(rows):
+        """Group rows by the partition they belong to"""
+        if not partitioning_enabled():
+            return [(Event.__table__, rows)]
+
+        months = {}
+        for row in rows:
+            months.setdefault(month_index(row['timestamp']), []).append(row)
+        return [(partition_for(rows[0]['timestamp']), rows) for rows in months.values()]
+
+    def flush(self):
+        """Commit everything written so far"""
+        db.session.commit()
+        self._uncommitted = 0
+        if self._platforms:
+            event_notifier.notify(self._platforms)
+            self._platforms = set()
 
 
 class EventCategory(db.Model):
@@ -88,7 +1033,8 @@ class ScheduledEvent(db.Model):
     schedule_time = db.Column(db.DateTime, nullable=False)
     platform = db.Column(db.String(20), nullable=False)
     event_type = db.Column(db.String(50), nullable=False)
-    user_id = db.Column(db.String(50), db.ForeignKey('users.id'))
+    # Checked at commit, like Event.user_id
+    user_id = db.Column(db.String(50), db.ForeignKey('users.id', deferrable=True, initially='DEFERRED'))
     params = db.Column(db.Text)  # JSON string
     executed = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -106,9 +1052,133 @@ class ReplayProgress(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class RetentionProgress(db.Model):
+    __tablename__ = 'retention_progress'
+
+    id = db.Column(db.Integer, primary_key=True)
+    in_progress = db.Column(db.Boolean, default=False)
+    cutoff = db.Column(db.DateTime)
+    current_table = db.Column(db.String(50))
+    # Current or last pass
+    rows_deleted = db.Column(db.Integer, default=0)
+    partitions_dropped = db.Column(db.Integer, default=0)
+    chunks = db.Column(db.Integer, default=0)
+    pages_reclaimed = db.Column(db.Integer, default=0)
+    # All passes
+    total_rows_deleted = db.Column(db.BigInteger, default=0)
+    total_bytes_reclaimed = db.Column(db.BigInteger, default=0)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'in_progress': self.in_progress,
+            'cutoff': self.cutoff.isoformat() if self.cutoff else None,
+            'current_table': self.current_table,
+            'rows_deleted': self.rows_deleted,
+            'partitions_dropped': self.partitions_dropped,
+            'chunks': self.chunks,
+            'pages_reclaimed': self.pages_reclaimed,
+            'total_rows_deleted': self.total_rows_deleted,
+            'total_bytes_reclaimed': self.total_bytes_reclaimed,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+
 class ConfigSetting(db.Model):
     __tablename__ = 'config'
 
     key = db.Column(db.String(50), primary_key=True)
     value = db.Column(db.Text, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def _rekey_legacy_events(inspector):
+    """Move an events table with random string ids onto integer ids.
+
+    Rows are copied in timestamp order, so the new ids follow event time.
+    Public ids of the existing rows change in the process.
+    """
+    id_column = next(c for c in inspector.get_columns('events') if c['name'] == 'id')
+    if isinstance(id_column['type'], db.Integer):
+        return
+
+    print("  Re-keying events onto integer ids...")
+    legacy_columns = {c['name'] for c in inspector.get_columns('events')}
+    for index in inspector.get_indexes('events'):
+        db.session.execute(db.text(f'DROP INDEX {index["name"]}'))
+    db.session.execute(db.text('ALTER TABLE events RENAME TO events_legacy'))
+    Event.__table__.create(bind=db.session.connection())
+
+    columns = ', '.join(c.name for c in Event.__table__.columns if c.name != 'id' and c.name in legacy_columns)
+    db.session.execute(db.text(
+        f'INSERT INTO events ({columns}) SELECT {columns} FROM events_legacy ORDER BY timestamp'
+    ))
+    db.session.execute(db.text('DROP TABLE events_legacy'))
+    db.session.commit()
+
+
+def _enable_incremental_vacuum():
+    """Switch an existing SQLite file to auto_vacuum=INCREMENTAL
+
+    The mode of a database that already has tables only changes with a
+    full VACUUM, so this rewrites the file once.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    if current_app.config['SQLITE_PRAGMAS'].get('auto_vacuum') != 'INCREMENTAL':
+        return
+
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() == 2:
+            return
+        print("  Enabling incremental vacuum (rewrites the database once)...")
+        connection.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+        connection.exec_driver_sql('VACUUM')
+
+
+def upgrade_schema():
+    """Bring an existing database up to the current schema.
+
+    db.create_all() only creates missing tables, so columns and indexes
+    added to a model after its table was created are added here, and a
+    legacy events table is re-keyed onto integer ids. Existing event
+    partitions are upgraded along with the events table, and SQLite files
+    are switched to incremental vacuum.
+    """
+    _register_partitions()
+    event_tables()
+    inspector = db.inspect(db.engine)
+    created_indexes = False
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+
+        if table.name == 'events':
+            _rekey_legacy_events(db.inspect(db.session.connection()))
+
+        existing = {index['name'] for index in db.inspect(db.session.connection()).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"  Creating index {index.name}...")
+                index.create(bind=db.session.connection())
+                created_indexes = True
+
+    if created_indexes:
+        # Refresh planner statistics so the new indexes get picked up
+        db.session.execute(db.text('ANALYZE'))
+
+    db.session.commit()
+
+    if EventCounter.query.first() is None:
+        print("  Counting existing events...")
+        reconcile_counters()
+    _enable_incremental_vacuum()
@@ -0,0 +1,173 @@
+from flask import current_app
+from datetime import datetime, timedelta
+import threading
+import time
+
+from models import RetentionProgress, bump_counters, db, drop_expired_partitions, event_tables, tally_events
+
+
+class RetentionService:
+    """Applies RETENTION_DAYS in small chunks so polling never waits long.
+
+    Each chunk deletes a keyset-ordered slice of expired consumed events
+    (by timestamp, id) in its own transaction; the chunk size adapts to
+    RETENTION_CHUNK_BUDGET_MS and the job pauses between chunks to let
+    other writers in. Freed pages are handed back with incremental vacuum.
+    """
+
+    # A pass marked in progress for longer than this is assumed dead
+    STALE_AFTER = timedelta(hours=1)
+
+    @staticmethod
+    def get_progress():
+        """Return the progress row, creating it if needed"""
+        progress = RetentionProgress.query.first()
+        if not progress:
+            progress = RetentionProgress()
+            db.session.add(progress)
+            db.session.commit()
+        return progress
+
+    @staticmethod
+    def start_pass():
+        """Claim the next pass; returns the progress row or None if one is running"""
+        progress = RetentionService.get_progress()
+        now = datetime.utcnow()
+        if progress.in_progress and progress.started_at and now - progress.started_at < RetentionService.STALE_AFTER:
+            return None
+
+        progress.in_progress = True
+        progress.cutoff = now - timedelta(days=current_app.config['RETENTION_DAYS'])
+        progress.current_table = None
+        progress.rows_deleted = 0
+        progress.partitions_dropped = 0
+        progress.chunks = 0
+        progress.pages_reclaimed = 0
+        progress.started_at = now
+        progress.completed_at = None
+        db.session.commit()
+        return progress
+
+    @staticmethod
+    def run_pass():
+        """Run one retention pass in the current app context"""
+        progress = RetentionService.start_pass()
+        if progress is None:
+            print("Retention pass already running, skipping")
+            return None
+
+        try:
+            cutoff = progress.cutoff
+            dropped_rows, dropped = drop_expired_partitions(cutoff)
+            progress.partitions_dropped = dropped
+            progress.rows_deleted = dropped_rows
+            progress.total_rows_deleted += dropped_rows
+            db.session.commit()
+
+            for table in event_tables(end=cutoff):
+                RetentionService.delete_expired(table, cutoff, progress)
+
+            RetentionService.incremental_vacuum(progress)
+        finally:
+            progress.in_progress = False
+            progress.current_table = None
+            progress.completed_at = datetime.utcnow()
+            db.session.commit()
+
+        print(f"Retention pass removed {progress.rows_deleted} events, "
+              f"reclaimed {progress.pages_reclaimed} pages")
+        return progress
+
+    @staticmethod
+    def delete_expired(table, cutoff, progress):
+        """Delete consumed events older than ``cutoff`` from one table, chunk by chunk"""
+        config = current_app.config
+        max_size = config['RETENTION_CHUNK_SIZE']
+        budget = config['RETENTION_CHUNK_BUDGET_MS'] / 1000
+        chunk_size = max_size
+        position = None
+
+        progress.current_table = table.name
+        db.session.commit()
+
+        while True:
+            started = time.monotonic()
+            query = (
+                db.select(table.c.timestamp, table.c.id, table.c.platform, table.c.source)
+                .where(table.c.consumed == True, table.c.timestamp < cutoff)
+                .order_by(table.c.timestamp, table.c.id)
+                .limit(chunk_size)
+            )
+            if position is not None:
+                query = query.where(db.tuple_(table.c.timestamp, table.c.id) > position)
+            keys = db.session.execute(query).all()
+            if not keys:
+                db.session.commit()
+                return
+
+            deleted = db.session.execute(
+                table.delete().where(table.c.id.in_([key.id for key in keys]))
+            ).rowcount
+            position = (keys[-1].timestamp, keys[-1].id)
+            bump_counters(tally_events(
+                (key.timestamp, key.platform, key.source, True) for key in keys
+            ), sign=-1)
+
+            progress.rows_deleted += deleted
+            progress.total_rows_deleted += deleted
+            progress.chunks += 1
+            db.session.commit()
+
+            # Keep each chunk's write lock within the budget
+            elapsed = time.monotonic() - started
+            if elapsed > budget:
+                chunk_size = max(100, chunk_size // 2)
+            elif elapsed < budget / 4:
+                chunk_size = min(max_size, chunk_size * 2)
+            time.sleep(elapsed)
+
+    @staticmethod
+    def incremental_vacuum(progress):
+        """Return free pages to the filesystem, a few at a time"""
+        if db.engine.dialect.name != 'sqlite':
+            return
+        if db.session.execute(db.text('PRAGMA auto_vacuum')).scalar() != 2:
+            return
+
+        pages = current_app.config['RETENTION_VACUUM_PAGES']
+        page_size = db.session.execute(db.text('PRAGMA page_size')).scalar()
+        while True:
+            free = db.session.execute(db.text('PRAGMA freelist_count')).scalar()
+            if not free:
+                break
+            started = time.monotonic()
+            # pysqlite steps a statement once, which frees a single page;
+            # executescript runs the pragma to completion
+            db.session.connection().connection.driver_connection.executescript(
+                f'PRAGMA incremental_vacuum({min(free, pages)})'
+            )
+            db.session.commit()
+
+            reclaimed = free - db.session.execute(db.text('PRAGMA freelist_count')).scalar()
+            if reclaimed <= 0:
+                break
+            progress.pages_reclaimed += reclaimed
+            progress.total_bytes_reclaimed += reclaimed * page_size
+            db.session.commit()
+            time.sleep(time.monotonic() - started)
+
+    @staticmethod
+    def run_in_background(app):
+        """Start a pass on a daemon thread; returns False if one is running"""
+        with app.app_context():
+            progress = RetentionService.get_progress()
+            if progress.in_progress and progress.started_at and \
+                    datetime.utcnow() - progress.started_at < RetentionService.STALE_AFTER:
+                return False
+
+        def run():
+            with app.app_context():
+                RetentionService.run_pass()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
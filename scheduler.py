@@ -1,13 +1,16 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime, timedelta
+import json
+import os
 import time
 import random
 
 def generate_daily_events():
     """Generate events for current day"""
-    from app import app, db, User, Event, ConfigSetting
+    from app import app, User, ConfigSetting
     from event_generator import EventGenerator
+    from models import EventWriter
 
     with app.app_context():
         # Check if we're in daily mode
@@ -38,25 +41,25 @@ def generate_daily_events():
         # Generate events for random subset of users (simulate realistic activity)
         active_users = random.sample(users, k=min(len(users), random.randint(10, 30)))
 
-        events_generated = 0
+        events = []
         for user in active_users:
             for platform in platforms:
                 # 30% chance to generate event for this user/platform combo
                 if random.random() < 0.3:
                     timestamp = now + timedelta(seconds=random.randint(0, 300))
-                    event_data = EventGenerator.generate_event(user, platform, timestamp, source='daily')
+                    events.append(EventGenerator.generate_event(
+                        user, platform, timestamp, source='daily', lazy=app.config['LAZY_PAYLOADS']
+                    ))
 
-                    event = Event(**event_data)
-                    db.session.add(event)
-                    events_generated += 1
-
-        db.session.commit()
-        print(f"Generated {events_generated} daily events at {now.strftime('%Y-%m-%d %H:%M:%S')}")
+        with EventWriter() as writer:
+            writer.write(events)
+        print(f"Generated {len(events)} daily events at {now.strftime('%Y-%m-%d %H:%M:%S')}")
 
 def check_scheduled_events():
     """Check and execute scheduled events"""
-    from app import app, db, ScheduledEvent, User, Event
+    from app import app, ScheduledEvent, User
     from event_generator import EventGenerator
+    from models import EventWriter
 
     with app.app_context():
         now = datetime.utcnow()
@@ -67,30 +70,62 @@ def check_scheduled_events():
             ScheduledEvent.executed == False
         ).all()
 
+        events = []
         for scheduled in due_events:
             user = User.query.get(scheduled.user_id) if scheduled.user_id else random.choice(User.query.all())
 
             if user:
-                event_data = EventGenerator.generate_event(
+                events.append(EventGenerator.generate_event(
                     user,
                     scheduled.platform,
                     now,
-                    source='manual'
-                )
-
-                event = Event(**event_data)
-                db.session.add(event)
+                    source='manual',
+                    lazy=app.config['LAZY_PAYLOADS']
+                ))
 
                 scheduled.executed = True
 
-        db.session.commit()
+        # Events and executed flags are committed together
+        with EventWriter() as writer:
+            writer.write(events)
 
         if due_events:
             print(f"Executed {len(due_events)} scheduled events")
 
+def apply_retention():
+    """Delete expired events and reclaim their space"""
+    from app import app
+    from retention import RetentionService
+
+    with app.app_context():
+        RetentionService.run_pass()
+
+
+def reconcile_event_counters():
+    """Recount events to correct drift in the stats counters"""
+    from app import app
+    from models import reconcile_counters
+
+    with app.app_context():
+        counted = reconcile_counters()
+        print(f"Reconciled event counters ({counted} events)")
+
+
+def archive_consumed_events():
+    """Move old consumed events into the columnar archive"""
+    from app import app
+    from archive import EventArchive
+
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+        archived = EventArchive().archive_consumed(cutoff)
+        print(f"Archived {archived} consumed events")
+
+
 def main():
     """Main scheduler loop"""
     print("Starting ASPHARE Event Generator Scheduler...")
+    os.environ.setdefault('SIMULATOR_PROCESS', 'scheduler')
 
     scheduler = BackgroundScheduler()
 
@@ -110,6 +145,34 @@ def main():
         name='Check scheduled events'
     )
 
+    # Apply the retention policy in small chunks
+    from config import Config
+    scheduler.add_job(
+        apply_retention,
+        'interval',
+        minutes=Config.RETENTION_INTERVAL_MINUTES,
+        id='retention',
+        name='Apply retention policy'
+    )
+
+    # Recount the stats counters
+    scheduler.add_job(
+        reconcile_event_counters,
+        'interval',
+        minutes=Config.COUNTER_RECONCILE_MINUTES,
+        id='reconcile_counters',
+        name='Reconcile event counters'
+    )
+
+    # Archive old consumed events nightly, if enabled
+    if Config.ARCHIVE_AFTER_DAYS > 0:
+        scheduler.add_job(
+            archive_consumed_events,
+            CronTrigger(hour=2, minute=30),
+            id='archive',
+            name='Archive consumed events'
+        )
+
     scheduler.start()
     print("Scheduler started successfully")
     print("Jobs:")
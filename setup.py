@@ -4,28 +4,73 @@ Usage:
     python setup.py --init-db              # Initialize database
     python setup.py --set-users 45         # Set user count
     python setup.py --seed-history 180     # Generate 180 days of events
+    python setup.py --seed-history 180 --workers 16 --seed 42
+    python setup.py --archive 30           # Archive consumed events older than 30 days
+    python setup.py --restore-archive 2025-01-01 2025-02-01
     python setup.py --all                  # Do everything
 """
 
+import os
 import sys
 import argparse
+import queue
+import threading
 from datetime import datetime
 
+MAX_USERS = 1000000
+
+
+def prefetch(iterable, depth=4):
+    """Run ``iterable`` in a background thread, buffering up to ``depth`` items.
+
+    Lets event generation continue while the previous chunk is being written.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            for item in iterable:
+                buffer.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            buffer.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    while True:
+        item = buffer.get()
+        if item is done:
+            break
+        yield item
+
+    if errors:
+        raise errors[0]
+
 
 def init_database():
     """Initialize database schema"""
     from app import app, db
+    from models import upgrade_schema
 
     with app.app_context():
         print("Creating database tables...")
         db.create_all()
+        upgrade_schema()
         print("✓ Database initialized")
 
 
 def seed_users(count=45):
-    """Seed database with fictional users"""
+    """Seed database with fictional users
+
+    The old users are replaced in one transaction. Events and scheduled
+    events of users that are not recreated are deleted with them.
+    """
     from app import app, db, User
-    from user_profiles import generate_user_profiles
+    from models import ScheduledEvent, delete_orphaned_events
+    from user_profiles import iter_user_profiles
 
     with app.app_context():
         # Check if users already exist
@@ -36,17 +81,23 @@ def seed_users(count=45):
             #if response.lower() != 'y':
             #  return
             User.query.delete()
-            db.session.commit()
 
         print(f"Generating {count} user profiles...")
-        profiles = generate_user_profiles(count)
-
-        for profile in profiles:
-            user = User(**profile)
-            db.session.add(user)
-
+        created = 0
+        for profiles in iter_user_profiles(count):
+            db.session.execute(User.__table__.insert(), profiles)
+            created += len(profiles)
+            if count > 10000:
+                print(f"  Inserted {created}/{count} users")
+
+        orphaned = delete_orphaned_events()
+        ScheduledEvent.query.filter(ScheduledEvent.user_id.not_in(db.select(User.id))) \
+            .delete(synchronize_session=False)
         db.session.commit()
-        print(f"✓ Created {count} users")
+
+        print(f"✓ Created {created} users")
+        if orphaned:
+            print(f"  Deleted {orphaned} events of removed users")
 
         # Show distribution
         from user_profiles import BEHAVIOR_PATTERNS
@@ -55,46 +106,49 @@ def seed_users(count=45):
             print(f"  - {pattern}: {count} users")
 
 
-def seed_historical_events(days=180):
+def seed_historical_events(days=180, workers=1, seed=None):
     """Generate historical events"""
-    from app import app, db, User, Event, ConfigSetting, ReplayProgress
-    from event_generator import EventGenerator
+    from app import app, db, User, ConfigSetting, ReplayProgress
+    from event_generator import EventGenerator, UserRef
+    from models import EventWriter, count_events, delete_events
 
     with app.app_context():
-        users = User.query.all()
+        users = [UserRef(u.id, u.name, u.behavior_pattern) for u in User.query.all()]
         if not users:
             print("Error: No users in database. Run --set-users first")
             return
 
         # Check if historical events exist
-        existing = Event.query.filter_by(source='historical').count()
+        existing = count_events(source='historical')
         if existing > 0:
             print(f"Database already has {existing} historical events")
             # response = input("Delete and regenerate? (y/n): ")
             # if response.lower() != 'y':
             #    return
-            Event.query.filter_by(source='historical').delete()
+            delete_events(source='historical')
             db.session.commit()
 
         print(f"\n Generating {days} days of historical events...")
         print(f"   Users: {len(users)}")
         print(f"   Estimated events: ~{len(users) * days * 30}")
-        print(f"   This may take 15-30 minutes...\n")
+        print(f"   This may take a minute...\n")
 
         start_time = datetime.now()
 
-        events = EventGenerator.generate_historical_events(users, days=days)
-
-        # Batch insert for performance
-        print("\nSaving events to database...")
-        batch_size = 1000
-        for i in range(0, len(events), batch_size):
-            batch = events[i:i + batch_size]
-            for event_data in batch:
-                event = Event(**event_data)
-                db.session.add(event)
-            db.session.commit()
-            print(f"  Saved {min(i + batch_size, len(events))}/{len(events)} events")
+        # Stream bounded chunks from the generator straight into the database
+        print("Saving events to database as they are generated...")
+        if seed is None:
+            seed = EventGenerator.new_seed()
+        chunks = EventGenerator.iter_historical_events(
+            users, days=days, seed=seed, chunk_size=app.config['EVENT_INSERT_BATCH_SIZE'],
+            workers=workers, lazy=app.config['LAZY_PAYLOADS']
+        )
+        with EventWriter() as writer:
+            for batch in prefetch(chunks):
+                writer.write(batch)
+                if writer.written % 50000 < len(batch):
+                    print(f"  Saved {writer.written} events")
+        total = writer.written
 
         # Initialize replay progress
         replay = ReplayProgress.query.first()
@@ -102,10 +156,17 @@ def seed_historical_events(days=180):
             replay = ReplayProgress()
             db.session.add(replay)
 
-        replay.total_events = len(events)
+        replay.total_events = total
         replay.consumed_events = 0
         replay.in_progress = False
 
+        # Remember the seed so this history can be regenerated
+        seed_setting = ConfigSetting.query.get('history_seed')
+        if seed_setting:
+            seed_setting.value = str(seed)
+        else:
+            db.session.add(ConfigSetting(key='history_seed', value=str(seed)))
+
         # Set mode to setup
         mode_setting = ConfigSetting.query.get('mode')
         if mode_setting:
@@ -116,10 +177,33 @@ def seed_historical_events(days=180):
         db.session.commit()
 
         elapsed = (datetime.now() - start_time).total_seconds()
-        print(f"\n✓ Generated {len(events)} historical events in {elapsed:.1f}s")
+        print(f"\n✓ Generated {total} historical events in {elapsed:.1f}s")
         print(f"  Ready for replay mode")
 
 
+def archive_events(days):
+    """Move consumed events older than ``days`` into the archive"""
+    from app import app
+    from archive import EventArchive
+    from datetime import timedelta
+
+    with app.app_context():
+        archive = EventArchive()
+        print(f"Archiving consumed events older than {days} days to {archive.directory}...")
+        archived = archive.archive_consumed(datetime.utcnow() - timedelta(days=days))
+        print(f"✓ Archived {archived} events")
+
+
+def restore_archive(start, end):
+    """Copy archived events in [start, end) back in as unconsumed"""
+    from app import app
+    from archive import EventArchive
+
+    with app.app_context():
+        restored = EventArchive().restore(datetime.fromisoformat(start), datetime.fromisoformat(end))
+        print(f"✓ Restored {restored} events for replay")
+
+
 def set_user_count(count):
     """Update user count in config"""
     from app import app, db, ConfigSetting
@@ -139,15 +223,17 @@ def set_user_count(count):
 
 def show_status():
     """Show current database status"""
-    from app import app, db, User, Event, ConfigSetting
+    from app import app, db, User, ConfigSetting
+    from models import counter_totals
 
     with app.app_context():
         users = User.query.count()
-        total_events = Event.query.count()
-        historical = Event.query.filter_by(source='historical').count()
-        daily = Event.query.filter_by(source='daily').count()
-        manual = Event.query.filter_by(source='manual').count()
-        consumed = Event.query.filter_by(consumed=True).count()
+        sources = counter_totals('source')
+        total_events = sum(total for total, consumed in sources.values())
+        historical = sources.get('historical', (0, 0))[0]
+        daily = sources.get('daily', (0, 0))[0]
+        manual = sources.get('manual', (0, 0))[0]
+        consumed = sum(consumed for total, consumed in sources.values())
 
         print("\n" + "=" * 50)
         print("ASPHARE Simulator Status")
@@ -167,10 +253,18 @@ def show_status():
 
 
 def main():
+    os.environ.setdefault('SIMULATOR_PROCESS', 'setup')
     parser = argparse.ArgumentParser(description='ASPHARE Event Simulator Setup')
     parser.add_argument('--init-db', action='store_true', help='Initialize database')
-    parser.add_argument('--set-users', type=int, metavar='N', help='Create N users (30-60)')
+    parser.add_argument('--set-users', type=int, metavar='N', help='Create N users (1-1,000,000)')
     parser.add_argument('--seed-history', type=int, metavar='DAYS', help='Generate historical events')
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='Generate history in N worker processes (default 1)')
+    parser.add_argument('--seed', type=int, metavar='SEED', help='Random seed for historical events')
+    parser.add_argument('--archive', type=int, metavar='DAYS',
+                        help='Archive consumed events older than DAYS')
+    parser.add_argument('--restore-archive', nargs=2, metavar=('FROM', 'TO'),
+                        help='Restore archived events between two ISO dates')
     parser.add_argument('--status', action='store_true', help='Show current status')
     parser.add_argument('--all', action='store_true', help='Initialize everything')
 
@@ -179,22 +273,26 @@ def main():
     if args.all:
         init_database()
         seed_users(45)
-        seed_historical_events(180)
+        seed_historical_events(180, workers=args.workers, seed=args.seed)
         show_status()
     elif args.init_db:
         init_database()
     elif args.set_users:
-        if 30 <= args.set_users <= 60:
+        if 1 <= args.set_users <= MAX_USERS:
             init_database()
             seed_users(args.set_users)
             set_user_count(args.set_users)
         else:
-            print("Error: User count must be between 30 and 60")
+            print(f"Error: User count must be between 1 and {MAX_USERS:,}")
     elif args.seed_history:
         if args.seed_history in [14, 30, 90, 180]:
-            seed_historical_events(args.seed_history)
+            seed_historical_events(args.seed_history, workers=args.workers, seed=args.seed)
         else:
             print("Error: History days must be 14, 30, 90, or 180")
+    elif args.archive is not None:
+        archive_events(args.archive)
+    elif args.restore_archive:
+        restore_archive(*args.restore_archive)
     elif args.status:
         show_status()
     else:
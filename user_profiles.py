@@ -1,4 +1,4 @@
-import random
+import numpy as np
 
 BEHAVIOR_PATTERNS = {
     'high_performer': {
@@ -9,7 +9,9 @@ BEHAVIOR_PATTERNS = {
         'jira_daily': (10, 15),
         'response_time_minutes': (5, 30),
         'work_pattern': 'consistent',
-        'description': 'Consistent high performance, occasional late nights'
+        'description': 'Consistent high performance, occasional late nights',
+        #                 0  1  2  3  4  5  6  7  8   9  10  11 12 13  14  15 16 17 18 19 20 21 22 23
+        'hourly_activity': [0, 0, 0, 0, 0, 0, 0, 1, 5, 9, 10, 10, 6, 9, 10, 10, 9, 7, 4, 2, 2, 3, 2, 0]
     },
     'steady_contributor': {
         'percentage': 0.50,
@@ -19,7 +21,8 @@ BEHAVIOR_PATTERNS = {
         'jira_daily': (5, 8),
         'response_time_minutes': (60, 120),
         'work_pattern': 'regular',
-        'description': 'Regular 9-6, predictable activity'
+        'description': 'Regular 9-6, predictable activity',
+        'hourly_activity': [0, 0, 0, 0, 0, 0, 0, 0, 1, 7, 10, 10, 4, 8, 10, 9, 8, 6, 1, 0, 0, 0, 0, 0]
     },
     'at_risk': {
         'percentage': 0.20,
@@ -29,7 +32,8 @@ BEHAVIOR_PATTERNS = {
         'jira_daily': (2, 5),
         'response_time_minutes': (240, 480),
         'work_pattern': 'irregular',
-        'description': 'Declining activity, irregular patterns'
+        'description': 'Declining activity, irregular patterns',
+        'hourly_activity': [1, 1, 0, 0, 0, 0, 0, 1, 1, 2, 4, 6, 5, 3, 5, 7, 6, 4, 3, 3, 4, 5, 4, 2]
     },
     'onboarding': {
         'percentage': 0.10,
@@ -39,7 +43,8 @@ BEHAVIOR_PATTERNS = {
         'jira_daily': (3, 7),
         'response_time_minutes': (60, 180),
         'work_pattern': 'learning',
-        'description': 'Ramping up, asking questions'
+        'description': 'Ramping up, asking questions',
+        'hourly_activity': [0, 0, 0, 0, 0, 0, 0, 0, 1, 5, 9, 10, 6, 8, 10, 10, 7, 4, 1, 0, 0, 0, 0, 0]
     }
 }
 
@@ -64,12 +69,8 @@ ROLES = [
 ]
 
 
-def generate_user_profiles(count=45):
-    """Generate realistic user profiles with behavior patterns"""
-    profiles = []
-    used_names = set()
-
-    # Calculate distribution
+def pattern_distribution(count):
+    """Number of users per behavior pattern for a population of ``count``"""
     distribution = {}
     for pattern, config in BEHAVIOR_PATTERNS.items():
         distribution[pattern] = int(count * config['percentage'])
@@ -79,28 +80,71 @@ def generate_user_profiles(count=45):
     if total < count:
         distribution['steady_contributor'] += (count - total)
 
-    user_id = 1
-    for pattern, num_users in distribution.items():
-        for _ in range(num_users):
-            # Generate unique name
-            while True:
-                first = random.choice(FIRST_NAMES)
-                last = random.choice(LAST_NAMES)
+    return distribution
+
+
+def middle_initials(tier):
+    """Initials for a name tier: '' for tier 0, then A..Z, AA..ZZ, AAA..."""
+    letters = []
+    while tier > 0:
+        tier, rem = divmod(tier - 1, 26)
+        letters.append(chr(ord('A') + rem))
+    return ''.join(reversed(letters))
+
+
+def iter_user_profiles(count=45, chunk_size=10000, seed=None):
+    """Yield realistic user profiles in lists of at most ``chunk_size``.
+
+    Names are assigned combinatorially instead of by retrying random picks:
+    user k gets the (k mod 900)-th first/last pair of a shuffled order, plus
+    middle initials once every pair has been used, so names and emails stay
+    unique for any population size. Behavior patterns follow
+    pattern_distribution exactly and are shuffled across users.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = len(FIRST_NAMES) * len(LAST_NAMES)
+    pair_order = rng.permutation(pairs)
+
+    pattern_names = list(BEHAVIOR_PATTERNS.keys())
+    distribution = pattern_distribution(count)
+    patterns = np.repeat(np.arange(len(pattern_names)), [distribution[p] for p in pattern_names])
+    rng.shuffle(patterns)
+
+    for start in range(0, count, chunk_size):
+        stop = min(start + chunk_size, count)
+        roles = rng.integers(len(ROLES), size=stop - start).tolist()
+        profiles = []
+
+        for k, pattern_idx, role_idx in zip(range(start, stop), patterns[start:stop].tolist(), roles):
+            tier, pair = divmod(k, pairs)
+            first_idx, last_idx = divmod(int(pair_order[pair]), len(LAST_NAMES))
+            first = FIRST_NAMES[first_idx]
+            last = LAST_NAMES[last_idx]
+            initials = middle_initials(tier)
+
+            if initials:
+                name = f"{first} {'.'.join(initials)}. {last}"
+                email = f"{first.lower()}.{initials.lower()}.{last.lower()}@asphare.com"
+            else:
                 name = f"{first} {last}"
-                if name not in used_names:
-                    used_names.add(name)
-                    break
+                email = f"{first.lower()}.{last.lower()}@asphare.com"
 
-            profile = {
-                'id': f'user_{user_id:03d}',
+            pattern = pattern_names[pattern_idx]
+            profiles.append({
+                'id': f'user_{k + 1:03d}',
                 'name': name,
-                'email': f"{first.lower()}.{last.lower()}@asphare.com",
-                'role': random.choice(ROLES),
+                'email': email,
+                'role': ROLES[role_idx],
                 'behavior_pattern': pattern,
                 'activity_multiplier': BEHAVIOR_PATTERNS[pattern]['activity_multiplier']
-            }
-            profiles.append(profile)
-            user_id += 1
+            })
+
+        yield profiles
 
-    random.shuffle(profiles)
-    return profiles
\ No newline at end of file
+
+def generate_user_profiles(count=45):
+    """Generate realistic user profiles with behavior patterns"""
+    profiles = []
+    for chunk in iter_user_profiles(count):
+        profiles.extend(chunk)
+    return profiles